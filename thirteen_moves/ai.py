@@ -1,28 +1,71 @@
 import math
 import random
+import time
+from collections import namedtuple
 from board import Board
+from transposition import TranspositionTable
+from ordering import MoveOrdering
 
 LOWERBOUND, EXACT, UPPERBOUND = -1, 0, 1
+# Last move count that is still searched, after it red wins on time
+LAST_MOVE = 24
+# Hand-picked weights by column (the index is `tile % WIDTH`), the defaults of the tables below
 tile_row_vals_red = [1.0, 1.1, 1.05, 1.1, 1.0]
 tile_row_vals_blue = [1.0, 1.1, 1.05, 1.1, 1.0]
-
-
-def position_id(tiles):
-    stiles = sorted(tiles)
-    if not stiles:
-        return 0
-    s = stiles[0]
-    n = s+0
-    for tile in stiles[1:]:
-        s *= 16
-        s += (tile-n)
-    return s
-
-
-def position_id_both(tiles):
-    id1 = position_id(tiles[0])
-    id2 = position_id(tiles[1])
-    return id1*1048576+id2
+# What a red or blue tile on each square is worth to `evaluate`, replaced by tuned
+# weights with `weights.load_weights`. Both are symmetric left to right, since a
+# position and its mirror image share table entries.
+red_square_vals = [tile_row_vals_blue[t % Board.WIDTH] for t in range(Board.WIDTH * Board.HEIGHT)]
+blue_square_vals = [tile_row_vals_red[t % Board.WIDTH] for t in range(Board.WIDTH * Board.HEIGHT)]
+# Width of the windows PVS tests moves with, below the smallest difference
+# of two evaluations, so a null window search can't fall between two scores
+NULL_WINDOW = 1e-6
+# Half width of the window around the last iteration's score that iterative
+# deepening searches the next depth with
+ASPIRATION_WINDOW = 0.5
+
+# Endgame tablebase probed by `minimax` before searching, see `tablebase.py`
+tablebase = None
+# Opening book `play` looks the position up in before searching, see `book.py`
+opening_book = None
+# Called as `stats_hook(result, moves, maximizing_player)` after every `play`, which
+# then always collects statistics, see `search_stats.JsonLinesWriter`
+stats_hook = None
+
+
+# Zobrist keys, one per (color, square) plus one for the side to move.
+# Seeded so hashes are the same in every process. Every key holds the
+# square's 64-bit key in its high half and the key of the mirrored square
+# in its low half, so one hash updates the hash of the position and of its
+# mirror image at once.
+_zobrist_rng = random.Random(13)
+_square_keys = [[_zobrist_rng.getrandbits(64) for _ in range(Board.WIDTH * Board.HEIGHT)] for _ in range(2)]
+ZOBRIST = tuple(tuple(keys[t] << 64 | keys[Board.mirror_tile(t)] for t in range(Board.WIDTH * Board.HEIGHT)) for keys in _square_keys)
+ZOBRIST_SIDE = _zobrist_rng.getrandbits(64) * ((1 << 64) + 1)
+# One key per move count, mixed into the table key of a position but not into the
+# hash passed down the search. Scores depend on the move count and a capture can
+# bring back a position at a different one.
+ZOBRIST_MOVES = tuple(_zobrist_rng.getrandbits(64) * ((1 << 64) + 1) for _ in range(LAST_MOVE + 2))
+HASH_MASK = (1 << 64) - 1
+
+
+def zobrist_hash(tiles, maximizing_player):
+    blue_keys, red_keys = ZOBRIST
+    h = ZOBRIST_SIDE if maximizing_player else 0
+    for tile in tiles[0]:
+        h ^= blue_keys[tile]
+    for tile in tiles[1]:
+        h ^= red_keys[tile]
+    return h
+
+
+# `nodes` is how many positions the search visited in this process, `stats` the
+# `search_stats.SearchStats` of the search if it was asked for
+SearchResult = namedtuple("SearchResult", ["move", "score", "depth", "nodes", "stats"], defaults=(0, None))
+
+
+class SearchTimeout(Exception):
+    pass
 
 
 def clone_tiles(tiles):
@@ -54,22 +97,72 @@ def get_valid_moves(tiles, maximizing_player):
     return valid_moves
 
 
+def drop_mirrored_moves(tiles, maximizing_player, valid_moves):
+    """
+    For symmetric positions, leaves out moves that are the mirror image of
+    an earlier move, both lead to the same (mirrored) position.
+    """
+    player_tiles = tiles[1] if maximizing_player else tiles[0]
+    seen = set()
+    result = []
+    for move in valid_moves:
+        from_tile, to_tile = player_tiles[move[0]], move[1]
+        if (Board.mirror_tile(from_tile), Board.mirror_tile(to_tile)) not in seen:
+            seen.add((from_tile, to_tile))
+            result.append(move)
+    return result
+
+
 def random_move(tiles, maximizing_player):
     return random.choice(get_valid_moves(tiles, maximizing_player))
 
 
-def perform_move(tiles, maximizing_player, move):
+def make_move(tiles, maximizing_player, move, h=0):
+    """
+    Performs `move` in place. Returns `h` updated for the move, the tile
+    the piece moved from and the index the captured enemy tile had (-1 if
+    nothing was captured), which is everything `unmake_move` needs.
+    """
     from_i, to_tile = move
 
     if maximizing_player:
-        tiles[1][from_i] = to_tile
-        enemy_tiles = tiles[0]
+        player_tiles, enemy_tiles = tiles[1], tiles[0]
+        player_keys, enemy_keys = ZOBRIST[1], ZOBRIST[0]
     else:
-        tiles[0][from_i] = to_tile
-        enemy_tiles = tiles[1]
+        player_tiles, enemy_tiles = tiles[0], tiles[1]
+        player_keys, enemy_keys = ZOBRIST[0], ZOBRIST[1]
+
+    from_tile = player_tiles[from_i]
+    h ^= player_keys[from_tile] ^ player_keys[to_tile] ^ ZOBRIST_SIDE
+    player_tiles[from_i] = to_tile
 
+    captured_i = -1
     if to_tile in enemy_tiles:
-        enemy_tiles.remove(to_tile)
+        captured_i = enemy_tiles.index(to_tile)
+        del enemy_tiles[captured_i]
+        h ^= enemy_keys[to_tile]
+    return h, from_tile, captured_i
+
+
+def unmake_move(tiles, maximizing_player, move, from_tile, captured_i):
+    from_i, to_tile = move
+
+    if maximizing_player:
+        player_tiles, enemy_tiles = tiles[1], tiles[0]
+    else:
+        player_tiles, enemy_tiles = tiles[0], tiles[1]
+
+    player_tiles[from_i] = from_tile
+    if captured_i >= 0:
+        enemy_tiles.insert(captured_i, to_tile)
+
+
+def perform_move(tiles, maximizing_player, move, h=0):
+    """
+    Returns `h` updated for the move, so passing the Zobrist hash of
+    the position gives the hash of the resulting position.
+    """
+    return make_move(tiles, maximizing_player, move, h)[0]
 
 
 def is_winning(tiles):
@@ -100,37 +193,101 @@ def evaluate_simple(tiles):
 
 def evaluate(tiles):
     # higher score is better for red
-    return sum(tile_row_vals_blue[t % 5] for t in tiles[1])-sum(tile_row_vals_red[t % 5] for t in tiles[0])
-
-
-# TODO: refactor minimax function so it doesn't repeat everything twice
-def minimax(tiles, depth, origDepth, alpha, beta, maximizing_player, moves, eval_func, tt):
-    pos_id = position_id_both(tiles)
-    lookup = tt.get(pos_id, None)
+    return sum(red_square_vals[t] for t in tiles[1])-sum(blue_square_vals[t] for t in tiles[0])
+
+
+def table_move(player_tiles, stored, mirrored):
+    """
+    Move of a transposition table entry as `[index into player_tiles, to_tile]`,
+    `None` if it doesn't fit the position.
+    """
+    from_tile, to_tile = stored
+    if mirrored:
+        from_tile, to_tile = Board.mirror_tile(from_tile), Board.mirror_tile(to_tile)
+    if from_tile not in player_tiles:
+        return None
+    return [player_tiles.index(from_tile), to_tile]
+
+
+def stored_move(player_tiles, move, mirrored):
+    from_tile, to_tile = player_tiles[move[0]], move[1]
+    if mirrored:
+        return Board.mirror_tile(from_tile), Board.mirror_tile(to_tile)
+    return from_tile, to_tile
+
+
+def order_moves(tiles, maximizing_player, moves, valid_moves, tt_move, ordering, root):
+    """
+    Sorts `valid_moves` in place with `ordering`, see `ordering.MoveOrdering`,
+    and puts the transposition table move first.
+    """
+    if maximizing_player:
+        player_tiles, enemy_tiles = tiles[1], tiles[0]
+    else:
+        player_tiles, enemy_tiles = tiles[0], tiles[1]
+    if root:
+        ordering.rng.shuffle(valid_moves)
+    score = ordering.score
+    valid_moves.sort(key=lambda move: score(player_tiles[move[0]], move[1], move[1] in enemy_tiles, maximizing_player, moves), reverse=True)
+    if tt_move in valid_moves:
+        # best move of an earlier, usually shallower, search goes first
+        valid_moves.remove(tt_move)
+        valid_moves.insert(0, tt_move)
+
+
+def negamax(tiles, depth, origDepth, alpha, beta, maximizing_player, moves, eval_func, tt, h, ordering, deadline=None):
+    """
+    Principal variation search. Scores are from the point of view of the
+    side to move, see `minimax` for red's. The first move is searched with
+    the full window, the others with a null window that only tells whether
+    they beat the best move so far, and again with the full window if they do.
+    """
+    player_tiles = tiles[1] if maximizing_player else tiles[0]
+    # the sign of red's scores for the side to move
+    sign = 1 if maximizing_player else -1
+
+    # a position and its mirror image share one entry, under the smaller of their hashes
+    key_h = h ^ ZOBRIST_MOVES[moves]
+    key, mirror_key = key_h >> 64, key_h & HASH_MASK
+    symmetric = key == mirror_key
+    mirrored = mirror_key < key
+    if mirrored:
+        key = mirror_key
+
+    tt_move = None
+    lookup = tt.probe(key)
     if lookup is not None:
-        flag, move, value, d = lookup
-        if d == depth:
+        flag, tt_move, value, d = lookup
+        # the table stores tiles, moves here use the index into `player_tiles`
+        if tt_move is not None:
+            tt_move = table_move(player_tiles, tt_move, mirrored)
+        if d >= depth and depth != origDepth:
             if flag == EXACT:
-                return move, value
+                return tt_move, value
             elif flag == LOWERBOUND:
                 alpha = max(alpha, value)
             elif flag == UPPERBOUND:
                 beta = min(beta, value)
             if alpha >= beta:
-                return move, value
+                return tt_move, value
 
     winning = is_winning(tiles)
     if winning:
         if winning == 1:
-            return None, -(27-moves)*10
+            return None, -sign*(27-moves)*10
         else:
-            return None, (27-moves)*10
+            return None, sign*(27-moves)*10
+
+    if moves > LAST_MOVE:
+        return None, sign*(27-moves)*10
 
-    if moves > 24:
-        return None, (27-moves)*10
+    if tablebase is not None and depth != origDepth:
+        value = tablebase.probe(tiles, moves)
+        if value is not None:
+            return None, sign*value
 
     if depth == 0:
-        return None, eval_func(tiles)
+        return None, sign*eval_func(tiles)
 
     if moves >= 17 and depth != origDepth:
         for t in tiles[0]:
@@ -139,81 +296,268 @@ def minimax(tiles, depth, origDepth, alpha, beta, maximizing_player, moves, eval
         else:
             if len(tiles[1]) > (26-moves) // 2:
                 # blue can never reach the other side or take all enemy pieces in the moves left
-                return None, 10
-
-    if maximizing_player:
-        valid_moves = get_valid_moves(tiles, True)
-        random.shuffle(valid_moves)
-
-        if depth > 1:
-            moves_ = []
-            for move in valid_moves:
-                clone = clone_tiles(tiles)
-                perform_move(clone, True, move)
-                moves_.append([clone, move, eval_func(clone)])
-            moves_.sort(key=lambda x: x[2], reverse=True)
+                return None, sign*10
+
+    if deadline is not None and depth > 1 and time.perf_counter() > deadline:
+        raise SearchTimeout
+
+    valid_moves = get_valid_moves(tiles, maximizing_player)
+    if symmetric:
+        valid_moves = drop_mirrored_moves(tiles, maximizing_player, valid_moves)
+    order_moves(tiles, maximizing_player, moves, valid_moves, tt_move, ordering, depth == origDepth)
+
+    # `tiles` is made/unmade in place, so it is the same position again on return
+    a = alpha
+    best_move = valid_moves[0]
+    best_value = -math.inf
+    for i, move in enumerate(valid_moves):
+        child_h, from_tile, captured_i = make_move(tiles, maximizing_player, move, h)
+        if i == 0:
+            value = -negamax(tiles, depth - 1, origDepth, -beta, -a, not maximizing_player, moves+1, eval_func, tt, child_h, ordering, deadline)[1]
         else:
-            moves_ = valid_moves
-
-        a = alpha
-        best_move = valid_moves[0]
-        max_eval = -math.inf
-        for move_ in moves_:
-            if depth > 1:
-                clone, move, _ = move_
-            else:
-                move = move_
-                clone = clone_tiles(tiles)
-                perform_move(clone, True, move)
-
-            current_eval = minimax(clone, depth - 1, origDepth, a, beta, False, moves+1, eval_func, tt)[1]
-            if current_eval > max_eval:
-                max_eval = current_eval
+            value = -negamax(tiles, depth - 1, origDepth, -a - NULL_WINDOW, -a, not maximizing_player, moves+1, eval_func, tt, child_h, ordering, deadline)[1]
+            if a < value < beta:
+                value = -negamax(tiles, depth - 1, origDepth, -beta, -a, not maximizing_player, moves+1, eval_func, tt, child_h, ordering, deadline)[1]
+        unmake_move(tiles, maximizing_player, move, from_tile, captured_i)
+        if value > best_value:
+            best_value = value
+            best_move = move
+        a = max(a, value)
+        if a >= beta:
+            ordering.cutoff(from_tile, move[1], captured_i >= 0, maximizing_player, moves, depth, i)
+            break
+
+    flag = UPPERBOUND if (best_value <= alpha) else (LOWERBOUND if (best_value >= beta) else EXACT)
+    tt.store(key, flag, stored_move(player_tiles, best_move, mirrored), best_value, depth)
+    return best_move, best_value
+
+
+def minimax(tiles, depth, origDepth, alpha, beta, maximizing_player, moves, eval_func, tt, h, ordering, deadline=None):
+    """
+    `negamax` with scores from red's point of view: higher is better for
+    red whichever side is to move.
+    """
+    if maximizing_player:
+        return negamax(tiles, depth, origDepth, alpha, beta, True, moves, eval_func, tt, h, ordering, deadline)
+    move, value = negamax(tiles, depth, origDepth, -beta, -alpha, False, moves, eval_func, tt, h, ordering, deadline)
+    return move, -value
+
+
+def _search_root_move(tiles, maximizing_player, moves, depth, origDepth, alpha, beta, eval_func, generation, deadline, count=False):
+    # runs in a worker process, whose own table is kept between calls
+    tt = get_transposition_table()
+    tt.generation = generation
+    h = zobrist_hash(tiles, maximizing_player)
+    if not count:
+        return minimax(tiles, depth, origDepth, alpha, beta, maximizing_player, moves, eval_func, tt, h, MoveOrdering(), deadline)[1]
+    from search_stats import count_search
+    return count_search(tt, lambda ordering: minimax(tiles, depth, origDepth, alpha, beta, maximizing_player, moves, eval_func,
+                                                     tt, h, ordering, deadline)[1])
+
+
+def parallel_minimax(tiles, depth, maximizing_player, moves, eval_func, tt, h, ordering, executor, deadline=None,
+                     alpha=-math.inf, beta=math.inf, stats=None):
+    """
+    Root splitting version of `minimax` with the same return value. The
+    first move is searched here to get a bound, then the other root moves
+    are searched with that bound by the workers of `executor` (usually a
+    `concurrent.futures.ProcessPoolExecutor`). What the workers did is
+    added to `stats`.
+    """
+    if depth < 2 or moves > LAST_MOVE or is_winning(tiles):
+        return minimax(tiles, depth, depth, alpha, beta, maximizing_player, moves, eval_func, tt, h, ordering, deadline)
+
+    key_h = h ^ ZOBRIST_MOVES[moves]
+    key, mirror_key = key_h >> 64, key_h & HASH_MASK
+    symmetric = key == mirror_key
+    mirrored = mirror_key < key
+    if mirrored:
+        key = mirror_key
+
+    valid_moves = get_valid_moves(tiles, maximizing_player)
+    if symmetric:
+        valid_moves = drop_mirrored_moves(tiles, maximizing_player, valid_moves)
+    player_tiles = tiles[1] if maximizing_player else tiles[0]
+    lookup = tt.probe(key)
+    tt_move = None
+    if lookup is not None and lookup[1] is not None:
+        tt_move = table_move(player_tiles, lookup[1], mirrored)
+    order_moves(tiles, maximizing_player, moves, valid_moves, tt_move, ordering, True)
+
+    best_move = valid_moves[0]
+    child_h, from_tile, captured_i = make_move(tiles, maximizing_player, best_move, h)
+    best_eval = minimax(tiles, depth - 1, depth, alpha, beta, not maximizing_player, moves+1, eval_func, tt, child_h, ordering, deadline)[1]
+    unmake_move(tiles, maximizing_player, best_move, from_tile, captured_i)
+
+    # a move that can't beat the first one fails low, which is all that needs to be known about it
+    a, b = (max(alpha, best_eval), beta) if maximizing_player else (alpha, min(beta, best_eval))
+    # a stop flag can't be sent to the workers, they stop at the time limit
+    worker_deadline = deadline.time if isinstance(deadline, Deadline) else deadline
+    futures = []
+    for move in valid_moves[1:] if a < b else []:
+        child = clone_tiles(tiles)
+        perform_move(child, maximizing_player, move)
+        future = executor.submit(_search_root_move, child, not maximizing_player, moves+1, depth - 1, depth, a, b,
+                                 eval_func, tt.generation, worker_deadline, stats is not None)
+        futures.append((move, future))
+
+    try:
+        for move, future in futures:
+            current_eval = future.result()
+            if stats is not None:
+                current_eval, counts = current_eval
+                stats.add_worker(counts)
+            if (current_eval > best_eval) if maximizing_player else (current_eval < best_eval):
+                best_eval = current_eval
                 best_move = move
-            a = max(a, current_eval)
-            if beta <= a:
-                break
-
-        tt[pos_id] = (UPPERBOUND if (max_eval <= alpha) else (LOWERBOUND if (max_eval >= beta) else EXACT), best_move, max_eval, depth)
-        return best_move, max_eval
-
-    else:
-        valid_moves = get_valid_moves(tiles, False)
-        if not moves:
-            valid_moves = valid_moves[:7]
-        random.shuffle(valid_moves)
-
-        if depth > 1:
-            moves_ = []
-            for move in valid_moves:
-                clone = clone_tiles(tiles)
-                perform_move(clone, False, move)
-                moves_.append([clone, move, eval_func(clone)])
-            moves_.sort(key=lambda x: x[2], reverse=False)
+    finally:
+        for _, future in futures:
+            future.cancel()
+
+    # the table holds `negamax` scores
+    sign = 1 if maximizing_player else -1
+    value = sign * best_eval
+    a, b = (alpha, beta) if maximizing_player else (-beta, -alpha)
+    flag = UPPERBOUND if (value <= a) else (LOWERBOUND if (value >= b) else EXACT)
+    tt.store(key, flag, stored_move(player_tiles, best_move, mirrored), value, depth)
+    return best_move, best_eval
+
+
+# Kept between `play` calls, so what was learned on one move is reused on the next
+transposition_table = None
+
+
+def get_transposition_table():
+    global transposition_table
+    if transposition_table is None:
+        transposition_table = TranspositionTable()
+    return transposition_table
+
+
+def aspiration_search(search, depth, deadline, guess):
+    """
+    Calls `search(depth, deadline, alpha, beta)` with a window around
+    `guess`, opening the window on the side the score falls out of until
+    it falls inside.
+    """
+    alpha, beta = guess - ASPIRATION_WINDOW, guess + ASPIRATION_WINDOW
+    while True:
+        move, score = search(depth, deadline, alpha, beta)
+        if score <= alpha:
+            alpha = -math.inf
+        elif score >= beta:
+            beta = math.inf
         else:
-            moves_ = valid_moves
-
-        b = beta
-        best_move = valid_moves[0]
-        min_eval = math.inf
-        for move_ in moves_:
-            if depth > 1:
-                clone, move, _ = move_
-            else:
-                move = move_
-                clone = clone_tiles(tiles)
-                perform_move(clone, False, move)
-
-            current_eval = minimax(clone, depth - 1, origDepth, alpha, b, True, moves+1, eval_func, tt)[1]
-            if current_eval < min_eval:
-                min_eval = current_eval
-                best_move = move
-            b = min(b, current_eval)
-            if b <= alpha:
-                break
-        tt[pos_id] = (UPPERBOUND if (min_eval <= alpha) else (LOWERBOUND if (min_eval >= beta) else EXACT), best_move, min_eval, depth)
-        return best_move, min_eval
-
-
-def play(board, maximizing_player, moves, depth):
-    return minimax(board.tiles, depth, depth, -math.inf, math.inf, maximizing_player, moves, evaluate, {})
\ No newline at end of file
+            return move, score
+
+
+class Deadline:
+    """
+    Deadline that has also passed once `stop.value` is set, `stop` being
+    shared with whoever may cancel the search (a `multiprocessing.Value`
+    for example). The search compares `time.perf_counter() > deadline`,
+    which Python turns into `deadline < now` for this class, so searches
+    with a plain float deadline don't pay for the check.
+    """
+    def __init__(self, time, stop):
+        self.time = time
+        self.stop = stop
+
+    def __lt__(self, now):
+        return now > self.time or self.stop.value
+
+
+def iterative_deepening(search, max_depth, time_ms, stop=None):
+    """
+    Calls `search(depth, deadline, alpha, beta)` for depths 1, 2, ...
+    `max_depth` until `time_ms` milliseconds have passed or `stop.value`
+    is set, and returns the result of the deepest search that finished.
+    Depth 1 always runs to completion, deeper searches start with an
+    aspiration window around the score of the one before.
+    """
+    deadline = time.perf_counter() + time_ms / 1000
+    if stop is not None:
+        deadline = Deadline(deadline, stop)
+    move, score = search(1, None)
+    reached = 1
+    for depth in range(2, max_depth + 1):
+        try:
+            move, score = aspiration_search(search, depth, deadline, score)
+        except SearchTimeout:
+            break
+        reached = depth
+    return SearchResult(move, score, reached)
+
+
+def play(board, maximizing_player, moves, depth=None, engine="list", time_ms=None, tt=None, executor=None, seed=None, stats=None,
+         stop=None):
+    """
+    Searches to `depth`, or with `time_ms` deepens iteratively until the
+    time is up (going no deeper than `depth` if it is given). Returns a
+    `SearchResult` with the move as `[index into the mover's tiles, to_tile]`.
+
+    `tt` defaults to a table shared by every call with the same engine.
+    With an `executor` the list and bitboard engines split the root moves
+    between its workers (see `parallel_minimax`). The "mcts" engine counts
+    `depth` in thousands of playouts and runs its playouts on the
+    `executor`, see `mcts.play`. Equally good moves are picked at random, a
+    `seed` makes the search repeatable. A `stats` object (see
+    `search_stats.SearchStats`) is filled in with what the search did.
+    Setting `stop.value` ends the search early with the move of the
+    deepest search that finished, see `Deadline`.
+    """
+    if stats is None and stats_hook is not None:
+        from search_stats import SearchStats
+        stats = SearchStats()
+    result = search_move(board, maximizing_player, moves, depth, engine, time_ms, tt, executor, seed, stats, stop)
+    if stats_hook is not None:
+        stats_hook(result, moves, maximizing_player)
+    return result
+
+
+def search_move(board, maximizing_player, moves, depth, engine, time_ms, tt, executor, seed, stats, stop):
+    if opening_book is not None:
+        entry = opening_book.choose(board.tiles, moves, maximizing_player)
+        if entry is not None:
+            (from_tile, to_tile), score = entry
+            player_tiles = board.tiles[1] if maximizing_player else board.tiles[0]
+            return SearchResult([player_tiles.index(from_tile), to_tile], score, opening_book.depth, stats=stats)
+
+    if engine == "bitboard":
+        # imported here since the bitboard engine reuses this module's constants
+        import bitboard
+        return bitboard.play(board, maximizing_player, moves, depth, time_ms, tt, seed, stats, stop, executor)
+    if engine == "mcts":
+        import mcts
+        return mcts.play(board, maximizing_player, moves, depth, time_ms, executor, seed, stats, stop)
+
+    # searched in place, so the board is left alone
+    tiles = clone_tiles(board.tiles)
+    h = zobrist_hash(tiles, maximizing_player)
+    if tt is None:
+        tt = get_transposition_table()
+    tt.new_search()
+    probes = tt.probes
+    ordering = MoveOrdering(seed) if stats is None else stats.ordering(seed)
+
+    def search(d, deadline=None, alpha=-math.inf, beta=math.inf):
+        if executor is not None:
+            return parallel_minimax(tiles, d, maximizing_player, moves, evaluate, tt, h, ordering, executor, deadline, alpha, beta,
+                                    stats)
+        return minimax(tiles, d, d, alpha, beta, maximizing_player, moves, evaluate, tt, h, ordering, deadline)
+
+    if stats is not None:
+        stats.start(tt)
+        search = stats.wrap(search)
+    if time_ms is None and stop is None:
+        result = SearchResult(*search(depth), depth)
+    else:
+        # a search that can be stopped deepens iteratively too, so it has a move when it is
+        max_depth = max(1, LAST_MOVE + 1 - moves)
+        if depth is not None:
+            max_depth = min(depth, max_depth)
+        result = iterative_deepening(search, max_depth, math.inf if time_ms is None else time_ms, stop)
+    if stats is not None:
+        stats.finish()
+    # every node probes the table once
+    return result._replace(nodes=tt.probes - probes, stats=stats)
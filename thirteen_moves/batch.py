@@ -0,0 +1,115 @@
+"""
+The evaluation, `is_winning` and move counting of `bitboard`, for many
+positions at once with NumPy, for offline work like building the book,
+tuning the evaluation or going through game records.
+
+Positions are given either packed, as an (N, 2) integer array of `(blue,
+red)` bitboards, or as an (N, 2, 30) occupancy array where
+`occupancy[i, 0, t]` is set if blue has a tile on square `t`. Every
+function takes both.
+"""
+import numpy as np
+import ai
+import bitboard
+from bitboard import WIDTH, HEIGHT, FULL, TOP_ROW, BOTTOM_ROW, NOT_LEFT, NOT_RIGHT, CHUNK_BITS, CHUNK_MASK
+
+SQUARES = WIDTH * HEIGHT
+
+# bits set in every 16-bit number
+POPCOUNT_16 = np.array([bin(k).count("1") for k in range(1 << 16)], dtype=np.int8)
+
+
+def from_positions(positions):
+    """
+    Packed array of an iterable of `bitboard` positions.
+    """
+    return np.array(list(positions), dtype=np.int64).reshape(-1, 2)
+
+
+def from_tiles(tiles_list):
+    """
+    Occupancy array of an iterable of `(blue tiles, red tiles)` as used
+    by `ai` and `Board.tiles`.
+    """
+    tiles_list = list(tiles_list)
+    occupancy = np.zeros((len(tiles_list), 2, SQUARES), dtype=bool)
+    for i, (blue, red) in enumerate(tiles_list):
+        occupancy[i, 0, blue] = True
+        occupancy[i, 1, red] = True
+    return occupancy
+
+
+def pack(occupancy):
+    return (np.asarray(occupancy, dtype=np.int64) << np.arange(SQUARES)).sum(axis=-1)
+
+
+def unpack(boards):
+    return (np.asarray(boards, dtype=np.int64)[..., None] >> np.arange(SQUARES)) & 1 == 1
+
+
+def packed(boards):
+    """
+    `boards` as an (N, 2) int64 array of bitboards, packing it if it is
+    an occupancy array.
+    """
+    boards = np.asarray(boards)
+    if boards.ndim == 3:
+        return pack(boards)
+    return boards.astype(np.int64, copy=False)
+
+
+def popcount(bb):
+    return POPCOUNT_16[bb & 0xffff] + POPCOUNT_16[bb >> 16]
+
+
+def evaluate_simple(boards):
+    boards = packed(boards)
+    return popcount(boards[:, 1]).astype(np.int64) - popcount(boards[:, 0])
+
+
+def evaluate(boards):
+    """
+    `bitboard.evaluate` of every position, higher is better for red.
+    """
+    boards = np.asarray(boards)
+    if boards.ndim == 3:
+        return boards[:, 1] @ np.array(ai.red_square_vals) - boards[:, 0] @ np.array(ai.blue_square_vals)
+    boards = packed(boards)
+    # the chunk tables follow the weights, see `bitboard.update_eval_tables`
+    red0, red1, red2 = np.array(bitboard.red_chunk_vals)
+    blue0, blue1, blue2 = np.array(bitboard.blue_chunk_vals)
+    blue, red = boards[:, 0], boards[:, 1]
+    return (red0[red & CHUNK_MASK] + red1[(red >> CHUNK_BITS) & CHUNK_MASK] + red2[red >> (2 * CHUNK_BITS)]
+            - blue0[blue & CHUNK_MASK] - blue1[(blue >> CHUNK_BITS) & CHUNK_MASK] - blue2[blue >> (2 * CHUNK_BITS)])
+
+
+def is_winning(boards):
+    """
+    `bitboard.is_winning` of every position as an int8 array, 0 where the
+    game isn't over.
+    """
+    boards = packed(boards)
+    blue, red = boards[:, 0], boards[:, 1]
+    # the same checks in reverse order, so the first one that applies wins
+    result = np.zeros(len(boards), dtype=np.int8)
+    result[(red & BOTTOM_ROW) != 0] = 2
+    result[(blue & TOP_ROW) != 0] = 1
+    result[red == 0] = 1
+    result[blue == 0] = 2
+    return result
+
+
+def count_moves(boards, maximizing_player):
+    """
+    `bitboard.count_moves` of every position. `maximizing_player` is a
+    bool for all positions or a bool array with one per position.
+    """
+    boards = packed(boards)
+    blue, red = boards[:, 0], boards[:, 1]
+    red_free = FULL & ~red
+    red_moves = (popcount(((red & NOT_LEFT) << (WIDTH - 1)) & red_free) + popcount((red << WIDTH) & red_free)
+                 + popcount(((red & NOT_RIGHT) << (WIDTH + 1)) & red_free))
+    blue_free = FULL & ~blue
+    blue_moves = (popcount(((blue & NOT_LEFT) >> (WIDTH + 1)) & blue_free) + popcount((blue >> WIDTH) & blue_free)
+                  + popcount(((blue & NOT_RIGHT) >> (WIDTH - 1)) & blue_free))
+    return np.where(maximizing_player, red_moves, blue_moves).astype(np.int64)
@@ -0,0 +1,257 @@
+import argparse
+import json
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ai
+import bitboard
+from ai import LAST_MOVE
+from board import Board
+from transposition import TranspositionTable
+
+# Leaf nodes of the move generator from the start position by depth. Positions
+# where the game is over aren't expanded.
+PERFT_COUNTS = {1: 13, 2: 169, 3: 1911, 4: 21609, 5: 237405, 6: 2606234, 7: 28686190}
+
+# (name, (blue tiles, red tiles), move count, search depth)
+CORPUS = [
+    ("start", ([25, 26, 27, 28, 29], [0, 1, 2, 3, 4]), 0, 8),
+    ("opening-1", ([23, 25, 26, 28, 29], [0, 2, 3, 4, 5]), 2, 8),
+    ("opening-2", ([22, 23, 25, 27, 28], [0, 1, 2, 4, 8]), 3, 8),
+    ("middlegame-1", ([17, 22, 23, 25, 29], [0, 1, 2, 7, 19]), 8, 8),
+    ("middlegame-2", ([12, 16, 25, 26, 28], [0, 3, 6, 8, 13]), 9, 8),
+    ("middlegame-3", ([20, 21, 22, 23, 24], [0, 5, 8, 9, 14]), 10, 8),
+    ("middlegame-4", ([20, 23, 24, 25], [3, 4, 6, 11, 12]), 11, 8),
+    ("middlegame-5", ([16, 17, 24, 25], [0, 1, 8, 9, 21]), 12, 8),
+    ("endgame-1", ([14, 20, 21, 22], [8, 9, 11, 12, 13]), 17, 8),
+    ("endgame-2", ([13, 17, 24, 25], [0, 6, 11, 12, 22]), 18, 7),
+    ("endgame-3", ([13, 15, 22, 23], [7, 8, 10, 16]), 19, 6),
+    ("endgame-4", ([9, 20, 25], [2, 10, 18, 22]), 20, 5),
+]
+
+ENGINES = ("list", "bitboard")
+
+
+def perft(tiles, maximizing_player, moves, depth):
+    """
+    Leaf nodes `depth` plies below the position, by making and unmaking
+    moves of the list engine.
+    """
+    if depth == 0:
+        return 1
+    if ai.is_winning(tiles) or moves > LAST_MOVE:
+        return 0
+    nodes = 0
+    for move in ai.get_valid_moves(tiles, maximizing_player):
+        _, from_tile, captured_i = ai.make_move(tiles, maximizing_player, move)
+        nodes += perft(tiles, not maximizing_player, moves + 1, depth - 1)
+        ai.unmake_move(tiles, maximizing_player, move, from_tile, captured_i)
+    return nodes
+
+
+def perft_bitboard(position, maximizing_player, moves, depth):
+    if depth == 0:
+        return 1
+    if bitboard.is_winning(position) or moves > LAST_MOVE:
+        return 0
+    if depth == 1:
+        return bitboard.count_moves(position, maximizing_player)
+    return sum(perft_bitboard(bitboard.perform_move(position, maximizing_player, move), not maximizing_player, moves + 1, depth - 1)
+               for move in bitboard.get_valid_moves(position, maximizing_player))
+
+
+def run_perft(engine, depth):
+    tiles = Board.new().tiles
+    start = time.perf_counter()
+    if engine == "bitboard":
+        nodes = perft_bitboard(bitboard.from_tiles(tiles), False, 0, depth)
+    else:
+        nodes = perft(tiles, False, 0, depth)
+    seconds = time.perf_counter() - start
+    return {"engine": engine, "depth": depth, "nodes": nodes, "expected": PERFT_COUNTS.get(depth),
+            "seconds": seconds, "nps": nodes / seconds if seconds else 0}
+
+
+def run_search(engine, name, tiles, moves, depth, repeat=1):
+    """
+    Searches a corpus position with an empty table, the fastest of `repeat`
+    runs is kept.
+    """
+    best = None
+    for _ in range(repeat):
+        tt = TranspositionTable()
+        board = Board((list(tiles[0]), list(tiles[1])))
+        start = time.perf_counter()
+        result = ai.play(board, moves % 2 == 1, moves, depth, engine=engine, tt=tt, seed=0)
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best["seconds"]:
+            best = {"engine": engine, "position": name, "depth": depth, "nodes": result.nodes, "seconds": seconds,
+                    "nps": result.nodes / seconds if seconds else 0, "tt_hit_rate": tt.hits / tt.probes if tt.probes else 0,
+                    "score": result.score}
+    return best
+
+
+def run(engines=ENGINES, perft_depth=5, repeat=1, progress=None):
+    """
+    Runs perft to `perft_depth` and searches the corpus with every engine.
+    Returns the results as a dict that can be written as JSON.
+    """
+    # searches must not be answered by the book or shortened by the tablebase
+    ai.opening_book = None
+    ai.tablebase = None
+
+    perft_results = []
+    searches = []
+    for engine in engines:
+        perft_results.append(run_perft(engine, perft_depth))
+        for name, tiles, moves, depth in CORPUS:
+            searches.append(run_search(engine, name, tiles, moves, depth, repeat))
+            if progress is not None:
+                progress(searches[-1])
+
+    totals = {}
+    for engine in engines:
+        results = [r for r in searches if r["engine"] == engine]
+        nodes = sum(r["nodes"] for r in results)
+        seconds = sum(r["seconds"] for r in results)
+        totals[engine] = {"nodes": nodes, "seconds": seconds, "nps": nodes / seconds if seconds else 0}
+    return {"python": sys.version.split()[0], "perft": perft_results, "searches": searches, "totals": totals}
+
+
+def random_position(rng, plies):
+    """
+    Position after up to `plies` random moves from the start, stopping
+    before a move that ends the game. Returns the tiles and the move count.
+    """
+    position = bitboard.from_tiles(Board.new().tiles)
+    for moves in range(plies):
+        child = bitboard.perform_move(position, moves % 2 == 1, bitboard.random_move(position, moves % 2 == 1, rng))
+        if bitboard.is_winning(child):
+            return bitboard.to_tiles(position), moves
+        position = child
+    return bitboard.to_tiles(position), plies
+
+
+def mirror_key_smaller(engine, tiles, moves):
+    # whether the position's table entry is kept under the key of its mirror image
+    if engine == "bitboard":
+        position = bitboard.from_tiles(tiles)
+        mirrored = bitboard.mirror(position[0]), bitboard.mirror(position[1])
+        return bitboard.position_key(mirrored, moves) < bitboard.position_key(position, moves)
+    key_h = ai.zobrist_hash(tiles, moves % 2 == 1) ^ ai.ZOBRIST_MOVES[moves]
+    return key_h & ai.HASH_MASK < key_h >> 64
+
+
+def check_parallel(engine, positions=20, depth=4, workers=2, seed=0):
+    """
+    Searches random positions to `depth` with and without splitting the
+    root moves between `workers` processes, every search with empty
+    tables. Returns the positions whose scores differ as `(tiles, moves,
+    serial score, parallel score)`, and how many of the positions were
+    kept under their mirror image's key.
+    """
+    ai.opening_book = None
+    ai.tablebase = None
+    rng = random.Random(seed)
+    mismatches = []
+    mirrored = 0
+    for _ in range(positions):
+        tiles, moves = random_position(rng, rng.randrange(2, LAST_MOVE - depth))
+        mirrored += mirror_key_smaller(engine, tiles, moves)
+        maximizing_player = moves % 2 == 1
+        serial = ai.play(Board((list(tiles[0]), list(tiles[1]))), maximizing_player, moves, depth, engine=engine,
+                         tt=TranspositionTable(), seed=0)
+        # a new pool each time, so the workers' tables are empty too
+        with ProcessPoolExecutor(workers) as executor:
+            parallel = ai.play(Board((list(tiles[0]), list(tiles[1]))), maximizing_player, moves, depth, engine=engine,
+                               tt=TranspositionTable(), executor=executor, seed=0)
+        if abs(serial.score - parallel.score) > 1e-9:
+            mismatches.append((tiles, moves, serial.score, parallel.score))
+    return mismatches, mirrored
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Compares with the results of an earlier run. Returns a line per search
+    and a line per regression: more nodes in a search (the search itself
+    got worse) or fewer nodes per second over all searches of an engine (it
+    got slower), by more than `tolerance`. Searches are too short for the
+    speed of a single one to be reliable, node counts are exact.
+    """
+    old_searches = {(r["engine"], r["position"], r["depth"]): r for r in baseline["searches"]}
+    lines = []
+    regressions = []
+    for r in results["searches"] + [dict(total, engine=engine, position="total", depth=0) for engine, total in results["totals"].items()]:
+        key = r["engine"], r["position"], r["depth"]
+        if r["position"] == "total":
+            old = baseline["totals"].get(r["engine"])
+        else:
+            old = old_searches.get(key)
+        if old is None:
+            continue
+        nodes = r["nodes"] / old["nodes"] - 1 if old["nodes"] else 0
+        nps = r["nps"] / old["nps"] - 1 if old["nps"] else 0
+        line = f"{r['engine']:<9} {r['position']:<13} nodes {nodes:+7.1%}  nps {nps:+7.1%}"
+        lines.append(line)
+        if nodes > tolerance or (r["position"] == "total" and nps < -tolerance):
+            regressions.append(line)
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the move generator with perft and time searches of a fixed set of positions.")
+    parser.add_argument("--engine", choices=ENGINES, action="append", help="engine to benchmark, both by default")
+    parser.add_argument("--perft-depth", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3, help="runs of every search, the fastest counts")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change of nodes or nps that counts as a regression")
+    parser.add_argument("--check-parallel", type=int, default=None, metavar="N",
+                        help="instead, check that N random positions get the same score with the root moves split between processes")
+    args = parser.parse_args()
+
+    if args.check_parallel is not None:
+        status = 0
+        for engine in args.engine or ENGINES:
+            mismatches, mirrored = check_parallel(engine, args.check_parallel)
+            print(f"{engine}: {len(mismatches)} of {args.check_parallel} positions differ, {mirrored} kept under the mirror key")
+            for tiles, moves, serial, parallel in mismatches:
+                print(f"  {tiles} moves {moves}: serial {serial:.4f} parallel {parallel:.4f}")
+            status = status or bool(mismatches)
+        sys.exit(int(status))
+
+    def progress(r):
+        print(f"{r['engine']:<9} {r['position']:<13} depth {r['depth']}  {r['nodes']:>8} nodes  {r['seconds']:6.3f}s  "
+              f"{r['nps']:>7.0f} nps  tt hits {r['tt_hit_rate']:.1%}", flush=True)
+
+    results = run(args.engine or ENGINES, args.perft_depth, args.repeat, progress)
+
+    status = 0
+    for r in results["perft"]:
+        ok = r["expected"] is None or r["nodes"] == r["expected"]
+        print(f"perft {r['engine']} depth {r['depth']}: {r['nodes']} nodes, {r['nps']:.0f} nps" + ("" if ok else f", expected {r['expected']}"))
+        if not ok:
+            status = 1
+    for engine, total in results["totals"].items():
+        print(f"total {engine}: {total['nodes']} nodes in {total['seconds']:.2f}s, {total['nps']:.0f} nps")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline, args.tolerance)
+        print("compared with", args.baseline)
+        print("\n".join(lines))
+        if regressions:
+            print(f"{len(regressions)} regressions:")
+            print("\n".join(regressions))
+            status = 1
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
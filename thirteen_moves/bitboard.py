@@ -0,0 +1,450 @@
+import math
+import random
+import time
+from board import Board
+import ai
+from transposition import TranspositionTable
+from ordering import MoveOrdering
+from ai import LOWERBOUND, EXACT, UPPERBOUND, LAST_MOVE, NULL_WINDOW, SearchResult, SearchTimeout, Deadline, iterative_deepening
+
+# Square `width*y+x` is bit `width*y+x` of a 30-bit integer, so a position
+# is just `(blue, red)` and children can be made without copying lists.
+WIDTH = Board.WIDTH
+HEIGHT = Board.HEIGHT
+FULL = (1 << (WIDTH * HEIGHT)) - 1
+
+COLUMNS = [sum(1 << (y * WIDTH + x) for y in range(HEIGHT)) for x in range(WIDTH)]
+NOT_LEFT = FULL & ~COLUMNS[0]
+NOT_RIGHT = FULL & ~COLUMNS[WIDTH - 1]
+TOP_ROW = (1 << WIDTH) - 1
+BOTTOM_ROW = TOP_ROW << (WIDTH * (HEIGHT - 1))
+# Rows a tile reaches the other side from in one move, which is always possible
+RED_LAST_STEP = BOTTOM_ROW >> WIDTH
+BLUE_LAST_STEP = TOP_ROW << WIDTH
+
+# BELOW_ROW[r] has every square with a row greater than r
+BELOW_ROW = [FULL & ~((1 << (WIDTH * (r + 1))) - 1) for r in range(HEIGHT)]
+
+# Evaluation is done two rows (10 bits) at a time, with the summed
+# square weights of every 10-bit pattern precomputed, one table for each
+# pair of rows
+CHUNK_BITS = 2 * WIDTH
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+red_chunk_vals = tuple([] for _ in range(HEIGHT // 2))
+blue_chunk_vals = tuple([] for _ in range(HEIGHT // 2))
+
+# MIRROR_CHUNK[k] is the 10-bit (two row) pattern k flipped left to right
+MIRROR_CHUNK = [sum(1 << (j - j % WIDTH + WIDTH - 1 - j % WIDTH) for j in range(CHUNK_BITS) if k >> j & 1) for k in range(1 << CHUNK_BITS)]
+
+# (shift, mask of squares that can move that way) in the same order as `ai.get_valid_moves`
+RED_DIRS = ((WIDTH - 1, NOT_LEFT), (WIDTH, FULL), (WIDTH + 1, NOT_RIGHT))
+BLUE_DIRS = ((-WIDTH - 1, NOT_LEFT), (-WIDTH, FULL), (-WIDTH + 1, NOT_RIGHT))
+# SQUARE_MOVES[maximizing_player][square] is `(move, to bit)` of every move a tile on
+# the square could make, in the order of the directions above
+SQUARE_MOVES = [[[((square, square + shift), 1 << (square + shift)) for shift, mask in dirs
+                  if 1 << square & mask and 0 <= square + shift < WIDTH * HEIGHT]
+                 for square in range(WIDTH * HEIGHT)]
+                for dirs in (BLUE_DIRS, RED_DIRS)]
+
+
+def update_eval_tables():
+    """
+    Must be called again whenever `ai.red_square_vals`/`ai.blue_square_vals` change.
+    """
+    for c in range(HEIGHT // 2):
+        red_chunk_vals[c][:] = [sum(ai.red_square_vals[c * CHUNK_BITS + j] for j in range(CHUNK_BITS) if k >> j & 1)
+                                for k in range(1 << CHUNK_BITS)]
+        blue_chunk_vals[c][:] = [sum(ai.blue_square_vals[c * CHUNK_BITS + j] for j in range(CHUNK_BITS) if k >> j & 1)
+                                 for k in range(1 << CHUNK_BITS)]
+
+
+update_eval_tables()
+
+
+def from_tiles(tiles):
+    blue = 0
+    for tile in tiles[0]:
+        blue |= 1 << tile
+    red = 0
+    for tile in tiles[1]:
+        red |= 1 << tile
+    return blue, red
+
+
+def to_tiles(position):
+    return squares(position[0]), squares(position[1])
+
+
+def squares(bb):
+    result = []
+    while bb:
+        low = bb & -bb
+        result.append(low.bit_length() - 1)
+        bb ^= low
+    return result
+
+
+def mirror(bb):
+    """
+    Flips a bitboard left to right, x -> WIDTH - 1 - x.
+    """
+    return (MIRROR_CHUNK[bb & CHUNK_MASK] | MIRROR_CHUNK[(bb >> CHUNK_BITS) & CHUNK_MASK] << CHUNK_BITS
+            | MIRROR_CHUNK[bb >> (2 * CHUNK_BITS)] << (2 * CHUNK_BITS))
+
+
+def position_key(position, moves):
+    """
+    Unique key of a nonterminal position at a move count that fits in 64
+    bits, as used by the transposition table and the tablebase and opening
+    book files. Nonterminal positions have no blue tile on the first row
+    and no red tile on the last one, so each side fits in 25 bits.
+    """
+    blue, red = position
+    return (moves << 50) | ((blue >> WIDTH) << 25) | red
+
+
+def mirror_key(key):
+    """
+    `position_key` of the mirror image of the position with `key`. Both
+    sides' bits are whole rows, so the 50 of them are flipped two rows at
+    a time like `mirror` does.
+    """
+    return (key >> 50 << 50 | MIRROR_CHUNK[key & CHUNK_MASK] | MIRROR_CHUNK[(key >> CHUNK_BITS) & CHUNK_MASK] << CHUNK_BITS
+            | MIRROR_CHUNK[(key >> (2 * CHUNK_BITS)) & CHUNK_MASK] << (2 * CHUNK_BITS)
+            | MIRROR_CHUNK[(key >> (3 * CHUNK_BITS)) & CHUNK_MASK] << (3 * CHUNK_BITS)
+            | MIRROR_CHUNK[(key >> (4 * CHUNK_BITS)) & CHUNK_MASK] << (4 * CHUNK_BITS))
+
+
+def get_valid_moves(position, maximizing_player):
+    """
+    Moves are `(from_square, to_square)` pairs, ordered by from square
+    and then by direction, which is the order the list engine produces
+    for a sorted tile list.
+    """
+    own = position[1] if maximizing_player else position[0]
+    square_moves = SQUARE_MOVES[maximizing_player]
+
+    valid_moves = []
+    pieces = own
+    while pieces:
+        low = pieces & -pieces
+        pieces ^= low
+        for move, to_bit in square_moves[low.bit_length() - 1]:
+            if not own & to_bit:
+                valid_moves.append(move)
+    return valid_moves
+
+
+def random_move(position, maximizing_player, rng=random):
+    return rng.choice(get_valid_moves(position, maximizing_player))
+
+
+def count_moves(position, maximizing_player):
+    if maximizing_player:
+        own = position[1]
+        targets = ((own & NOT_LEFT) << (WIDTH - 1), own << WIDTH, (own & NOT_RIGHT) << (WIDTH + 1))
+    else:
+        own = position[0]
+        targets = ((own & NOT_LEFT) >> (WIDTH + 1), own >> WIDTH, (own & NOT_RIGHT) >> (WIDTH - 1))
+    free = FULL & ~own
+    return sum((t & free).bit_count() for t in targets)
+
+
+def perform_move(position, maximizing_player, move):
+    from_tile, to_tile = move
+    blue, red = position
+    to_bit = 1 << to_tile
+    if maximizing_player:
+        return blue & ~to_bit, red ^ (1 << from_tile) ^ to_bit
+    return blue ^ (1 << from_tile) ^ to_bit, red & ~to_bit
+
+
+def is_winning(position):
+    blue, red = position
+
+    if not blue:
+        return 2
+    if not red:
+        return 1
+    if blue & TOP_ROW:
+        return 1
+    if red & BOTTOM_ROW:
+        return 2
+    return False
+
+
+def evaluate_simple(position):
+    return position[1].bit_count() - position[0].bit_count()
+
+
+def evaluate(position):
+    # higher score is better for red
+    blue, red = position
+    red0, red1, red2 = red_chunk_vals
+    blue0, blue1, blue2 = blue_chunk_vals
+    return (red0[red & CHUNK_MASK] + red1[(red >> CHUNK_BITS) & CHUNK_MASK] + red2[red >> (2 * CHUNK_BITS)]
+            - blue0[blue & CHUNK_MASK] - blue1[(blue >> CHUNK_BITS) & CHUNK_MASK] - blue2[blue >> (2 * CHUNK_BITS)])
+
+
+def mirror_move(move):
+    return Board.mirror_tile(move[0]), Board.mirror_tile(move[1])
+
+
+def drop_mirrored_moves(valid_moves):
+    """
+    For symmetric positions, leaves out moves that are the mirror image of
+    an earlier move.
+    """
+    seen = set()
+    result = []
+    for move in valid_moves:
+        if mirror_move(move) not in seen:
+            seen.add(move)
+            result.append(move)
+    return result
+
+
+def order_moves(position, maximizing_player, moves, valid_moves, tt_move, ordering, root):
+    """
+    Sorts `valid_moves` in place with `ordering`, see `ordering.MoveOrdering`,
+    and puts the transposition table move first.
+    """
+    if root:
+        ordering.rng.shuffle(valid_moves)
+    enemy = position[0] if maximizing_player else position[1]
+    scores = ordering.square_scores(valid_moves, enemy, maximizing_player, moves)
+    # sorting the indices by score keeps the scoring out of the sort's key calls
+    valid_moves[:] = [valid_moves[i] for i in sorted(range(len(valid_moves)), key=scores.__getitem__, reverse=True)]
+    if tt_move in valid_moves:
+        # best move of an earlier, usually shallower, search goes first
+        valid_moves.remove(tt_move)
+        valid_moves.insert(0, tt_move)
+
+
+def negamax(position, depth, origDepth, alpha, beta, maximizing_player, moves, eval_func, tt, ordering, deadline=None):
+    """
+    Same search as `ai.negamax`, scores are from the point of view of the
+    side to move.
+    """
+    sign = 1 if maximizing_player else -1
+    blue, red = position
+
+    # `is_winning` and `position_key` written out, they are called for every node
+    if not red or blue & TOP_ROW:
+        return None, -sign*(27-moves)*10
+    if not blue or red & BOTTOM_ROW:
+        return None, sign*(27-moves)*10
+
+    if moves > LAST_MOVE:
+        return None, sign*(27-moves)*10
+
+    # a position and its mirror image share one entry, under the smaller key. The key
+    # holds the move count, which the win scores and the time limit depend on.
+    key = (moves << 50) | ((blue >> WIDTH) << 25) | red
+    mirrored_key = mirror_key(key)
+    symmetric = key == mirrored_key
+    mirrored = mirrored_key < key
+    if mirrored:
+        key = mirrored_key
+
+    tt_move = None
+    lookup = tt.probe(key)
+    if lookup is not None:
+        flag, tt_move, value, d = lookup
+        if mirrored and tt_move is not None:
+            tt_move = mirror_move(tt_move)
+        move = tt_move
+        if d >= depth and depth != origDepth:
+            if flag == EXACT:
+                return move, value
+            elif flag == LOWERBOUND:
+                alpha = max(alpha, value)
+            elif flag == UPPERBOUND:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return move, value
+
+    if ai.tablebase is not None and depth != origDepth:
+        value = ai.tablebase.probe_position(position, moves)
+        if value is not None:
+            return None, sign*value
+
+    if depth == 0:
+        return None, sign*eval_func(position)
+
+    if moves >= 17 and depth != origDepth:
+        if not blue & BELOW_ROW[12 - moves // 2]:
+            if red.bit_count() > (26-moves) // 2:
+                # blue can never reach the other side or take all enemy pieces in the moves left
+                return None, sign*10
+
+    if deadline is not None and depth > 1 and time.perf_counter() > deadline:
+        raise SearchTimeout
+
+    valid_moves = get_valid_moves(position, maximizing_player)
+    if symmetric:
+        valid_moves = drop_mirrored_moves(valid_moves)
+    order_moves(position, maximizing_player, moves, valid_moves, tt_move, ordering, depth == origDepth)
+
+    enemy = blue if maximizing_player else red
+    a = alpha
+    best_move = valid_moves[0]
+    best_value = -math.inf
+    for i, move in enumerate(valid_moves):
+        # `perform_move` written out
+        from_tile, to_tile = move
+        to_bit = 1 << to_tile
+        if maximizing_player:
+            child = blue & ~to_bit, red ^ (1 << from_tile) ^ to_bit
+        else:
+            child = blue ^ (1 << from_tile) ^ to_bit, red & ~to_bit
+        if i == 0:
+            value = -negamax(child, depth - 1, origDepth, -beta, -a, not maximizing_player, moves+1, eval_func, tt, ordering, deadline)[1]
+        else:
+            value = -negamax(child, depth - 1, origDepth, -a - NULL_WINDOW, -a, not maximizing_player, moves+1, eval_func, tt, ordering, deadline)[1]
+            if a < value < beta:
+                value = -negamax(child, depth - 1, origDepth, -beta, -a, not maximizing_player, moves+1, eval_func, tt, ordering, deadline)[1]
+        if value > best_value:
+            best_value = value
+            best_move = move
+        a = max(a, value)
+        if a >= beta:
+            ordering.cutoff(move[0], move[1], enemy >> move[1] & 1, maximizing_player, moves, depth, i)
+            break
+
+    flag = UPPERBOUND if (best_value <= alpha) else (LOWERBOUND if (best_value >= beta) else EXACT)
+    tt.store(key, flag, mirror_move(best_move) if mirrored else best_move, best_value, depth)
+    return best_move, best_value
+
+
+def minimax(position, depth, origDepth, alpha, beta, maximizing_player, moves, eval_func, tt, ordering, deadline=None):
+    """
+    `negamax` with scores from red's point of view, like `ai.minimax`.
+    """
+    if maximizing_player:
+        return negamax(position, depth, origDepth, alpha, beta, True, moves, eval_func, tt, ordering, deadline)
+    move, value = negamax(position, depth, origDepth, -beta, -alpha, False, moves, eval_func, tt, ordering, deadline)
+    return move, -value
+
+
+def _search_root_move(position, maximizing_player, moves, depth, origDepth, alpha, beta, generation, deadline, count=False):
+    # runs in a worker process, whose own table is kept between calls
+    tt = get_transposition_table()
+    tt.generation = generation
+    if not count:
+        return minimax(position, depth, origDepth, alpha, beta, maximizing_player, moves, evaluate, tt, MoveOrdering(), deadline)[1]
+    from search_stats import count_search
+    return count_search(tt, lambda ordering: minimax(position, depth, origDepth, alpha, beta, maximizing_player, moves, evaluate,
+                                                     tt, ordering, deadline)[1])
+
+
+def parallel_minimax(position, depth, maximizing_player, moves, tt, ordering, executor, deadline=None,
+                     alpha=-math.inf, beta=math.inf, stats=None):
+    """
+    Root splitting version of `minimax`, like `ai.parallel_minimax`: the
+    first move is searched here and the others by the workers of `executor`
+    with the bound it gives. What the workers did is added to `stats`.
+    """
+    if depth < 2 or moves > LAST_MOVE or is_winning(position):
+        return minimax(position, depth, depth, alpha, beta, maximizing_player, moves, evaluate, tt, ordering, deadline)
+
+    key = position_key(position, moves)
+    mirrored_key = mirror_key(key)
+    symmetric = key == mirrored_key
+    mirrored = mirrored_key < key
+    if mirrored:
+        key = mirrored_key
+
+    valid_moves = get_valid_moves(position, maximizing_player)
+    if symmetric:
+        valid_moves = drop_mirrored_moves(valid_moves)
+    lookup = tt.probe(key)
+    tt_move = None
+    if lookup is not None and lookup[1] is not None:
+        tt_move = mirror_move(lookup[1]) if mirrored else lookup[1]
+    order_moves(position, maximizing_player, moves, valid_moves, tt_move, ordering, True)
+
+    best_move = valid_moves[0]
+    child = perform_move(position, maximizing_player, best_move)
+    best_eval = minimax(child, depth - 1, depth, alpha, beta, not maximizing_player, moves+1, evaluate, tt, ordering, deadline)[1]
+
+    # a move that can't beat the first one fails low, which is all that needs to be known about it
+    a, b = (max(alpha, best_eval), beta) if maximizing_player else (alpha, min(beta, best_eval))
+    # a stop flag can't be sent to the workers, they stop at the time limit
+    worker_deadline = deadline.time if isinstance(deadline, Deadline) else deadline
+    futures = []
+    for move in valid_moves[1:] if a < b else []:
+        child = perform_move(position, maximizing_player, move)
+        future = executor.submit(_search_root_move, child, not maximizing_player, moves+1, depth - 1, depth, a, b,
+                                 tt.generation, worker_deadline, stats is not None)
+        futures.append((move, future))
+
+    try:
+        for move, future in futures:
+            current_eval = future.result()
+            if stats is not None:
+                current_eval, counts = current_eval
+                stats.add_worker(counts)
+            if (current_eval > best_eval) if maximizing_player else (current_eval < best_eval):
+                best_eval = current_eval
+                best_move = move
+    finally:
+        for _, future in futures:
+            future.cancel()
+
+    # the table holds `negamax` scores
+    sign = 1 if maximizing_player else -1
+    value = sign * best_eval
+    a, b = (alpha, beta) if maximizing_player else (-beta, -alpha)
+    flag = UPPERBOUND if (value <= a) else (LOWERBOUND if (value >= b) else EXACT)
+    tt.store(key, flag, mirror_move(best_move) if mirrored else best_move, value, depth)
+    return best_move, best_eval
+
+
+# Kept between `play` calls like `ai.transposition_table`, the keys of the two engines differ
+transposition_table = None
+
+
+def get_transposition_table():
+    global transposition_table
+    if transposition_table is None:
+        transposition_table = TranspositionTable()
+    return transposition_table
+
+
+def play(board, maximizing_player, moves, depth=None, time_ms=None, tt=None, seed=None, stats=None, stop=None, executor=None):
+    """
+    Same contract as `ai.play`: the returned move is
+    `[index into the mover's tile list, to_tile]`, and with an `executor`
+    the root moves are split between its workers.
+    """
+    position = from_tiles(board.tiles)
+    if tt is None:
+        tt = get_transposition_table()
+    tt.new_search()
+    probes = tt.probes
+    ordering = MoveOrdering(seed) if stats is None else stats.ordering(seed)
+
+    def search(d, deadline=None, alpha=-math.inf, beta=math.inf):
+        if executor is not None:
+            return parallel_minimax(position, d, maximizing_player, moves, tt, ordering, executor, deadline, alpha, beta, stats)
+        return minimax(position, d, d, alpha, beta, maximizing_player, moves, evaluate, tt, ordering, deadline)
+
+    if stats is not None:
+        stats.start(tt)
+        search = stats.wrap(search)
+    if time_ms is None and stop is None:
+        result = SearchResult(*search(depth), depth)
+    else:
+        # a search that can be stopped deepens iteratively too, so it has a move when it is
+        max_depth = max(1, LAST_MOVE + 1 - moves)
+        if depth is not None:
+            max_depth = min(depth, max_depth)
+        result = iterative_deepening(search, max_depth, math.inf if time_ms is None else time_ms, stop)
+
+    if stats is not None:
+        stats.finish()
+
+    from_tile, to_tile = result.move
+    player_tiles = board.tiles[1] if maximizing_player else board.tiles[0]
+    return result._replace(move=[player_tiles.index(from_tile), to_tile], nodes=tt.probes - probes, stats=stats)
@@ -8,6 +8,8 @@ class Board:
 
     def __init__(self, tiles):
         self.tiles = tiles
+        # color -> {from tile: set of to tiles}, see `moves_from`
+        self.move_cache = {}
 
     def __str__(self):
         tiles = self.to_array()
@@ -73,13 +75,45 @@ class Board:
 
     def clone(self):
         tiles = (self.tiles[0].copy(), self.tiles[1].copy())
-        return Board(tiles)
+        board = Board(tiles)
+        # the cached sets are never changed, only replaced
+        board.move_cache = self.move_cache.copy()
+        return board
+
+    @staticmethod
+    def mirror_tile(tile):
+        """
+        The tile mirrored left to right, x -> WIDTH - 1 - x. The rules are
+        the same for mirrored positions.
+        """
+        return tile - 2 * (tile % Board.WIDTH) + Board.WIDTH - 1
 
     @staticmethod
     def in_bounds(x, y):
         return 0 <= x < Board.WIDTH and 0 <= y < Board.HEIGHT
 
+    def moves_from(self, color):
+        """
+        `{from tile: set of to tiles}` of the valid moves of `color`, kept
+        until `perform_move` changes the position. Change `tiles` only
+        through `perform_move`, or the cache goes stale.
+        """
+        moves = self.move_cache.get(color)
+        if moves is None:
+            moves = {}
+            for from_tile, to_tile in self.generate_moves(color):
+                moves.setdefault(from_tile, set()).add(to_tile)
+            self.move_cache[color] = moves
+        return moves
+
+    def is_valid_move(self, color, move):
+        from_tile, to_tile = move
+        return to_tile in self.moves_from(color).get(from_tile, ())
+
     def get_valid_moves(self, color):
+        return [[from_tile, to_tile] for from_tile, to_tiles in self.moves_from(color).items() for to_tile in sorted(to_tiles)]
+
+    def generate_moves(self, color):
         width = Board.WIDTH
 
         if color == BLUE:
@@ -116,6 +150,7 @@ class Board:
         player_tiles[player_tiles.index(from_tile)] = to_tile
         if to_tile in enemy_tiles:
             enemy_tiles.remove(to_tile)
+        self.move_cache.clear()
 
     def is_winning(self):
         blue_tiles = self.tiles[0]
@@ -0,0 +1,170 @@
+import argparse
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ai
+import bitboard
+import position_file
+from board import Board
+from ordering import MoveOrdering
+
+KIND = b"BOOK"
+
+
+def mirror_position(position):
+    return bitboard.mirror(position[0]), bitboard.mirror(position[1])
+
+
+def mirror_move(move):
+    return Board.mirror_tile(move[0]), Board.mirror_tile(move[1])
+
+
+def canonical(position, moves):
+    """
+    Returns the smaller of the keys of the position and of its mirror image
+    and whether that is the mirror image's key. The rules are the same
+    mirrored, so the book only stores one of the two.
+    """
+    key = bitboard.position_key(position, moves)
+    mirrored_key = bitboard.position_key(mirror_position(position), moves)
+    if mirrored_key < key:
+        return mirrored_key, True
+    return key, False
+
+
+def pack(move, score):
+    # score in hundredths above the move's two tiles
+    return round(score * 100) << 10 | move[0] << 5 | move[1]
+
+
+def unpack(value):
+    return ((value >> 5) & 31, value & 31), (value >> 10) / 100
+
+
+def book_positions(plies):
+    """
+    Yields `(position, moves)` for one of each mirror pair of the positions
+    reachable in the first `plies` plies, in the orientation the book
+    stores them in.
+    """
+    layer = [bitboard.from_tiles(Board.new().tiles)]
+    for moves in range(plies):
+        yield from ((position, moves) for position in layer)
+
+        maximizing_player = moves % 2 == 1
+        children = {}
+        for position in layer:
+            for move in bitboard.get_valid_moves(position, maximizing_player):
+                child = bitboard.perform_move(position, maximizing_player, move)
+                if bitboard.is_winning(child):
+                    continue
+                key, mirrored = canonical(child, moves + 1)
+                children[key] = mirror_position(child) if mirrored else child
+        layer = list(children.values())
+
+
+def score_moves(position, moves, depth):
+    """
+    Searches every move of the position to `depth`, leaving out moves that
+    are the mirror image of another move in symmetric positions.
+    """
+    maximizing_player = moves % 2 == 1
+    tt = bitboard.get_transposition_table()
+    tt.new_search()
+    ordering = MoveOrdering()
+    symmetric = mirror_position(position) == position
+
+    scored = []
+    for move in bitboard.get_valid_moves(position, maximizing_player):
+        if symmetric and any(mirror_move(move) == other for other, _ in scored):
+            continue
+        child = bitboard.perform_move(position, maximizing_player, move)
+        score = bitboard.minimax(child, depth - 1, depth, -math.inf, math.inf, not maximizing_player, moves + 1, bitboard.evaluate, tt, ordering)[1]
+        scored.append((move, score))
+    return scored
+
+
+def build(plies, depth, workers=1, progress=None):
+    """
+    Returns sorted `(key, packed move and score)` records for every book
+    position, searched by `workers` processes.
+    """
+    positions = list(book_positions(plies))
+    records = []
+    with ProcessPoolExecutor(workers) as executor:
+        results = executor.map(score_moves, *zip(*positions), [depth] * len(positions))
+        for i, ((position, moves), scored) in enumerate(zip(positions, results)):
+            key = bitboard.position_key(position, moves)
+            records += [(key, pack(move, score)) for move, score in scored]
+            if progress is not None:
+                progress(i + 1, len(positions))
+    records.sort()
+    return records
+
+
+class OpeningBook:
+    """
+    Scored moves for the first `plies` plies, read from a file made by `build`.
+    """
+    def __init__(self, path):
+        self.file = position_file.PositionFile(path, KIND)
+        self.plies, self.depth = self.file.params[:2]
+
+    def moves(self, tiles, moves):
+        """
+        Returns `[((from_tile, to_tile), score), ...]` for a list engine
+        position, empty if the position isn't in the book.
+        """
+        if moves >= self.plies:
+            return []
+        position = bitboard.from_tiles(tiles)
+        key, mirrored = canonical(position, moves)
+        entries = [unpack(value) for value in self.file.get_all(key)]
+        if mirrored:
+            entries = [(mirror_move(move), score) for move, score in entries]
+        if mirror_position(position) == position:
+            # the mirror image of a move was left out when it was stored
+            entries += [(mirror_move(move), score) for move, score in entries if mirror_move(move) != move]
+        return entries
+
+    def choose(self, tiles, moves, maximizing_player, rng=random):
+        """
+        One of the best scored moves, picked at random, or `None`.
+        """
+        entries = self.moves(tiles, moves)
+        if not entries:
+            return None
+        best = (max if maximizing_player else min)(score for _, score in entries)
+        return rng.choice([entry for entry in entries if entry[1] == best])
+
+
+def load_book(path):
+    """
+    Makes `ai.play` use the opening book at `path` if the file exists.
+    """
+    if ai.opening_book is None and os.path.exists(path):
+        ai.opening_book = OpeningBook(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an opening book by searching every position of the first plies.")
+    parser.add_argument("--plies", type=int, default=2, help="number of plies from the start of the game in the book")
+    parser.add_argument("--depth", type=int, default=10, help="search depth of every move")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--out", default="opening_book.bin")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    def progress(done, total):
+        print(f"{done}/{total} positions, {time.perf_counter() - start:.0f}s", flush=True)
+
+    records = build(args.plies, args.depth, args.workers, progress)
+    position_file.write(args.out, KIND, [key for key, _ in records], [value for _, value in records], "i", (args.plies, args.depth))
+    print(f"wrote {len(records)} moves to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
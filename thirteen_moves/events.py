@@ -2,17 +2,20 @@ import pygame
 
 
 class Events:
-    def __init__(self, event_quit, mouse_down, mouse_up, mouse_pos):
+    def __init__(self, event_quit, mouse_down, mouse_up, mouse_pos, exposed=False):
         self.quit = event_quit
         self.mouse_down = mouse_down
         self.mouse_up = mouse_up
         self.mouse_pos = mouse_pos
+        # the window was covered or minimized, so everything has to be drawn again
+        self.exposed = exposed
 
     @classmethod
     def update(cls):
         event_quit = False
         mouse_down = False
         mouse_up = False
+        exposed = False
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -21,6 +24,8 @@ class Events:
                 mouse_down = True
             elif event.type == pygame.MOUSEBUTTONUP:
                 mouse_up = True
+            elif event.type == pygame.WINDOWEXPOSED:
+                exposed = True
         mouse_pos = pygame.mouse.get_pos()
 
-        return cls(event_quit, mouse_down, mouse_up, mouse_pos)
+        return cls(event_quit, mouse_down, mouse_up, mouse_pos, exposed)
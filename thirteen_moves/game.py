@@ -1,11 +1,18 @@
 from board import Board
 import pygame
 from visual_utils import alpha_rect, centered_text, set_cursor_to_default, Text
-from ai import play
+from ai import play, LAST_MOVE
+from transposition import TranspositionTable
+from tablebase import load_tablebase
+from book import load_book
+from weights import load_weights
+from game_log import GameRecord, Ply, player_name, write_game
+import multiprocessing
 import time
-import random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 
+BACKGROUND = (240, 240, 240)
 END = (32, 32, 32)
 GRAY = (160, 160, 160)
 WHITE = (255, 255, 255)
@@ -17,14 +24,39 @@ TILE_RED = "R"
 # Possible options: `TILE_BLUE`, `TILE_RED`
 AI_PLAYER = [TILE_RED]
 
-# Depth of each AI player
+# Depth of each AI player, the max depth if the player also has a time limit
 DEPTHS = {TILE_BLUE: 10, TILE_RED: 10}
 
+# Milliseconds each AI player may search per move, `None` always searches to the full depth
+TIME_LIMITS = {TILE_BLUE: 1000, TILE_RED: 1000}
+
+# Search engine used by the AI players
+# Possible options: "list", "bitboard", "mcts"
+ENGINE = "bitboard"
+
+# Worker processes the AI splits its search between, 1 searches in the game's process
+WORKERS = 1
+
+# Endgame tablebase made by `python3 tablebase.py`, used if the file exists
+TABLEBASE = "tablebase.bin"
+
+# Search the AI's answers to the human's moves while the human thinks
+PONDER = True
+
+# Depth of the search that guesses the human's move, whose answer is searched first
+PREDICT_DEPTH = 4
+
 # Min time for an AI move so it feels natural
 wait = 0.5
 
-# Only winning first moves (depth 26)
-first_blue_move = [[1, 20], [3, 24]]
+# Opening book made by `python3 book.py`, used if the file exists
+OPENING_BOOK = "opening_book.bin"
+
+# Evaluation weights made by `python3 tune.py`, used if the file exists
+EVAL_WEIGHTS = "weights.json"
+
+# Game log finished games are appended to, see `game_log.py`, `None` to not record games
+GAME_LOG = "games.log"
 
 YELLOW = (246, 190, 0)
 RED = (135, 34, 34)
@@ -33,6 +65,50 @@ LIGHT_RED = (255, 102, 102)
 LIGHT_BLUE = (102, 102, 255)
 
 
+def load_search_files():
+    """
+    Loads the tablebase and evaluation weights, also the initializer of
+    the workers a split search runs on.
+    """
+    load_tablebase(TABLEBASE)
+    load_weights(EVAL_WEIGHTS)
+
+
+def load_ai_files():
+    """
+    Loads the tablebase, evaluation weights and opening book, also the
+    initializer of the process the AI searches in.
+    """
+    load_search_files()
+    load_book(OPENING_BOOK)
+
+
+# Tables of the ponder searches and of the guess of the human's move, and the flag
+# that stops a ponder search that turned out to be useless, in the ponder process
+ponder_tt = None
+predict_tt = None
+ponder_stop = None
+
+
+def init_ponder(stop):
+    """
+    Initializer of the process the ponder searches run in.
+    """
+    global ponder_tt, predict_tt, ponder_stop
+    ponder_tt = TranspositionTable()
+    predict_tt = TranspositionTable(1)
+    ponder_stop = stop
+    load_ai_files()
+
+
+def predict_move(board, maximizing_player, moves):
+    return play(board, maximizing_player, moves, depth=PREDICT_DEPTH, engine=ENGINE, tt=predict_tt, stop=ponder_stop).move
+
+
+def ponder_search(board, maximizing_player, moves, depth, time_ms):
+    return play(board, maximizing_player, moves, depth=depth, engine=ENGINE, time_ms=time_ms, tt=ponder_tt, stop=ponder_stop)
+
+
 class Game:
     def __init__(self, board, x, y, width, height, tile_padding, x_center):
         self.board = board
@@ -53,6 +129,36 @@ class Game:
         self.winning = None
         self.player = TILE_BLUE
         self.moves = 0
+        # the moves of the game for the game log and when the current turn started
+        self.plies = []
+        self.turn_start = time.time()
+        # what the last `display` drew, `None` to draw everything
+        self.drawn = None
+
+        load_ai_files()
+        # The AI searches off the main thread so the window keeps responding. A single
+        # search gets a process of its own, which keeps its transposition table between
+        # moves; a split search is run by a thread that hands the root moves to the workers.
+        if WORKERS > 1:
+            self.executor = ProcessPoolExecutor(WORKERS, initializer=load_search_files)
+            self.search_executor = ThreadPoolExecutor(1)
+        else:
+            self.executor = None
+            self.search_executor = ProcessPoolExecutor(1, initializer=load_ai_files)
+        # future of the AI's move while it is thinking and the position it searches, see `position`
+        self.search = None
+        self.search_position = None
+        self.search_start = None
+        # futures of the AI's answers by human move and the moves still to search while pondering,
+        # the guess of the human's move and the last job given to the ponder executor
+        self.ponder_searches = None
+        self.ponder_queue = []
+        self.ponder_prediction = None
+        self.ponder_running = None
+        # The ponder searches run in a process of their own, with their own tables and
+        # without the workers, which stay free for the AI's own searches
+        self.ponder_stop = multiprocessing.Value("b", 0, lock=False)
+        self.ponder_executor = ProcessPoolExecutor(1, initializer=init_ponder, initargs=(self.ponder_stop,))
 
         self.new_game_text = Text("New Game", self.x_center, y + self.height * 15/24, GRAY, WHITE, font_size=40)
 
@@ -72,11 +178,16 @@ class Game:
     def new_game(self):
         set_cursor_to_default()
 
+        # a search of the old game still finishes, its move is ignored
+        self.search = None
+        self.stop_pondering()
         self.board = Board.new()
         self.winning = None
         self.held_tile = None
         self.player = TILE_BLUE
         self.moves = 0
+        self.plies = []
+        self.turn_start = time.time()
 
     def mouse_pos_to_tile(self, mouse_pos):
         x, y = mouse_pos
@@ -85,6 +196,17 @@ class Game:
 
         return round(x-0.5), round(y-0.5)
 
+    def cell_rect(self, tile_pos):
+        """
+        The part of the board the tile and its padding take up.
+        """
+        x, y = tile_pos
+        left = int(self.tile_width * x + self.x)
+        top = int(self.tile_height * y + self.y)
+        right = int(self.tile_width * (x + 1) + self.x) + 1
+        bottom = int(self.tile_height * (y + 1) + self.y) + 1
+        return pygame.Rect(left, top, right - left, bottom - top)
+
     def tile_pos_to_rect(self, tile_pos):
         x, y = tile_pos
 
@@ -96,26 +218,72 @@ class Game:
 
     def switch_player(self):
         self.moves += 1
+        self.turn_start = time.time()
         if self.player == TILE_BLUE:
             self.player = TILE_RED
         else:
             self.player = TILE_BLUE
 
-    def display(self, surface, events):
-        self.display_move_counter(surface)
+    def quit(self):
+        # waits for a running search, which stops at its time limit, a ponder search is stopped
+        self.ponder_stop.value = 1
+        self.search_executor.shutdown(cancel_futures=True)
+        self.ponder_executor.shutdown(cancel_futures=True)
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
 
+    def display(self, surface, events):
+        """
+        Draws what changed since the last call and returns the rects that
+        were drawn, for `pygame.display.update`. A held tile or the end
+        screen cover the board, so while either is shown any change redraws
+        the whole screen, otherwise only the header and the changed tiles
+        are drawn again.
+        """
+        header = self.moves, self.search is not None
+        overlay = (self.held_tile, events.mouse_pos if self.held_tile is not None else None,
+                   self.winning, self.new_game_text.highlighted if self.winning is not None else None)
+        drawn = None if events.exposed else self.drawn
+        self.drawn = header, overlay, [column.copy() for column in self.tiles]
+        if drawn == self.drawn:
+            return []
+
+        if drawn is None or drawn[1] != overlay or self.held_tile is not None or self.winning is not None:
+            surface.fill(BACKGROUND)
+            self.display_header(surface)
+            for x in range(Board.WIDTH):
+                for y in range(Board.HEIGHT):
+                    self.display_tile(surface, (x, y))
+
+            if not (self.held_tile is None):
+                self.highlight_valid_moves(surface, self.held_tile)
+                self.display_tile_on_mouse(surface, self.held_tile, events.mouse_pos)
+
+            if not (self.winning is None):
+                self.display_end_screen(surface)
+                self.display_player_wins(surface)
+                self.new_game_text.display(surface)
+            return [surface.get_rect()]
+
+        dirty = []
+        if drawn[0] != header:
+            dirty.append(self.display_header(surface))
         for x in range(Board.WIDTH):
             for y in range(Board.HEIGHT):
-                self.display_tile(surface, (x, y))
-
-        if not (self.held_tile is None):
-            self.highlight_valid_moves(surface, self.held_tile)
-            self.display_tile_on_mouse(surface, self.held_tile, events.mouse_pos)
-
-        if not (self.winning is None):
-            self.display_end_screen(surface)
-            self.display_player_wins(surface)
-            self.new_game_text.display(surface)
+                if drawn[2][x][y] != self.tiles[x][y]:
+                    rect = self.cell_rect((x, y))
+                    surface.fill(BACKGROUND, rect)
+                    self.display_tile(surface, (x, y))
+                    dirty.append(rect)
+        return dirty
+
+    def display_header(self, surface):
+        rect = pygame.Rect(0, 0, surface.get_width(), self.y)
+        surface.fill(BACKGROUND, rect)
+        self.display_move_counter(surface)
+        if self.search is not None:
+            self.display_thinking(surface)
+        return rect
 
     def display_tile(self, surface, tile_pos):
         x, y = tile_pos
@@ -136,12 +304,13 @@ class Game:
             pygame.draw.rect(surface, RED, rect)
 
     def highlight_valid_moves(self, surface, tile):
-        for move in self.board.get_valid_moves(TILE_BLUE):
-            if move[0] == tile:
-                self.highlight_move(surface, move)
+        color, x, y = tile
+        from_tile = y*Board.WIDTH+x
+        for to_tile in self.board.moves_from(color).get(from_tile, ()):
+            self.highlight_move(surface, [from_tile, to_tile])
 
     def highlight_move(self, surface, move):
-        tile_pos = move.xto, move.yto
+        tile_pos = move[1] % Board.WIDTH, move[1] // Board.WIDTH
         self.highlight_tile(surface, tile_pos)
 
     def highlight_tile(self, surface, tile_pos):
@@ -172,6 +341,111 @@ class Game:
         text = f"{moves_left} Move{add_s} Left"
         centered_text(surface, text, x, y, font_size=font_size)
 
+    def display_thinking(self, surface, x=None, y=None, font_size=25):
+        if x is None:
+            x = self.x_center
+        if y is None:
+            y = self.y * 5/6
+        centered_text(surface, "Thinking...", x, y, GRAY, font_size=font_size)
+
+    def position(self):
+        return self.moves, tuple(self.board.tiles[0]), tuple(self.board.tiles[1])
+
+    def accepts_input(self):
+        """
+        Whether the human may move: it is their turn and no search of the
+        AI's is waiting to be played.
+        """
+        return self.player not in AI_PLAYER and self.search is None
+
+    def start_search(self):
+        self.search_start = time.time()
+        self.search_position = self.position()
+        self.search = self.search_executor.submit(play, self.board.clone(), self.player == TILE_RED, self.moves,
+                                                  depth=DEPTHS[self.player], engine=ENGINE,
+                                                  time_ms=TIME_LIMITS[self.player], executor=self.executor)
+
+    def finish_search(self):
+        result = self.search.result()
+        self.search = None
+        if self.search_position != self.position():
+            # searched for a position the game has left, `update` starts a new search
+            return
+        move, score, depth = result.move, result.score, result.depth
+        if self.player == TILE_BLUE:
+            move[0] = self.board.tiles[0][move[0]]
+        else:
+            move[0] = self.board.tiles[1][move[0]]
+        print("depth:", depth, "time:", time.time()-self.search_start, "eval:", round(score, 2))
+        self.board.perform_move(self.player, move)
+        self.plies.append(Ply(*move, score, depth, 1000 * (time.time() - self.turn_start), result.nodes))
+        self.tiles = self.board.to_array()
+        self.switch_player()
+
+    def ponder_replies(self, predicted):
+        """
+        The human's moves that don't end the game, with the position after
+        each, `predicted` (a move of `predict_move`) first.
+        """
+        player_tiles = self.board.tiles[1] if self.player == TILE_RED else self.board.tiles[0]
+        predicted = (player_tiles[predicted[0]], predicted[1])
+
+        replies = []
+        for reply in sorted(map(tuple, self.board.get_valid_moves(self.player)), key=lambda move: move != predicted):
+            board = self.board.clone()
+            board.perform_move(self.player, reply)
+            if not board.is_winning() and self.moves + 1 <= LAST_MOVE:
+                replies.append((reply, board))
+        return replies
+
+    def ponder_done(self):
+        return self.ponder_running is None or self.ponder_running.done()
+
+    def ponder(self):
+        """
+        Searches the AI's answers to the human's moves during the human's
+        turn, one at a time in an executor of their own. First a short
+        search guesses the human's move, whose answer is searched first.
+        """
+        if self.ponder_searches is None:
+            # a search stopped last turn ends before the flag is cleared for the new ones
+            if not self.ponder_done():
+                return
+            self.ponder_stop.value = 0
+            self.ponder_searches = {}
+            self.ponder_prediction = self.ponder_executor.submit(predict_move, self.board.clone(), self.player == TILE_RED, self.moves)
+            self.ponder_running = self.ponder_prediction
+        if self.ponder_prediction is not None:
+            if not self.ponder_prediction.done():
+                return
+            self.ponder_queue = self.ponder_replies(self.ponder_prediction.result())
+            self.ponder_prediction = None
+        if self.ponder_queue and self.ponder_done():
+            reply, board = self.ponder_queue.pop(0)
+            ai_player = TILE_RED if self.player == TILE_BLUE else TILE_BLUE
+            self.ponder_running = self.ponder_executor.submit(ponder_search, board, ai_player == TILE_RED, self.moves + 1,
+                                                              DEPTHS[ai_player], TIME_LIMITS[ai_player])
+            self.ponder_searches[reply] = self.ponder_running
+
+    def stop_pondering(self, move=None):
+        """
+        The search of the answer to `move`, the move the human made,
+        becomes the AI's search if it was started. A ponder search still
+        running for another move is stopped.
+        """
+        if self.ponder_searches is None:
+            return
+        adopted = self.ponder_searches.get(tuple(move)) if move is not None else None
+        if adopted is not None:
+            self.search = adopted
+            self.search_position = self.position()
+            self.search_start = time.time()
+        if self.ponder_running is not adopted:
+            self.ponder_stop.value = 1
+        self.ponder_searches = None
+        self.ponder_queue = []
+        self.ponder_prediction = None
+
     def update(self, events, surface):
         self.tiles = self.board.to_array()
         self.new_game_text.update(events)
@@ -180,52 +454,45 @@ class Game:
         mouse_pos = events.mouse_pos
         x, y = self.mouse_pos_to_tile(mouse_pos)
 
-        if mouse_down and Board.in_bounds(x, y) and (self.winning is None):
+        if not self.accepts_input():
+            self.held_tile = None
+        elif mouse_down and Board.in_bounds(x, y) and (self.winning is None):
             self.select_tile(x, y)
         elif mouse_up and not (self.held_tile is None):
             self.release_tile(x, y)
 
-        winning = self.board.is_winning()
-        if winning == TILE_BLUE:
-            self.winning = TILE_BLUE
-        elif winning == TILE_RED:
-            self.winning = TILE_RED
-        elif 13-(self.moves+1)//2 <= 0:
-            self.winning = TILE_RED
+        if self.winning is None:
+            winning = self.board.is_winning()
+            if winning == TILE_BLUE:
+                self.winning = TILE_BLUE
+            elif winning == TILE_RED:
+                self.winning = TILE_RED
+            elif 13-(self.moves+1)//2 <= 0:
+                self.winning = TILE_RED
+            if self.winning is not None:
+                self.record_game()
 
         if self.player in AI_PLAYER and self.winning is None:
-            self.tiles = self.board.to_array()
-            self.display(surface, events)
-            pygame.display.flip()
-            start = time.time()
-            # Random first moves since they don't rly matter
-            if self.moves == 0:
-                move, score = random.choice(first_blue_move), 0
-            elif self.moves == 1:
-                if self.board.tiles[0][1] == 20:
-                    move, score = [0, 6], 0
-                else:
-                    move, score = [4, 8], 0
-            else:
-                move, score = play(self.board, self.player == TILE_RED, self.moves, depth=DEPTHS[self.player])
-            end = time.time()
-            if self.player == TILE_BLUE:
-                move[0] = self.board.tiles[0][move[0]]
-            else:
-                move[0] = self.board.tiles[1][move[0]]
-            if wait-(end-start) > 0:
-                time.sleep(wait-(end-start))
-            if end-start < wait:
-                time.sleep(wait-(end-start))
-            print("depth:", DEPTHS[self.player], "time:", end-start, "eval:", round(score, 2))
-            self.board.perform_move(self.player, move)
-            self.tiles = self.board.to_array()
-            self.switch_player()
+            if self.search is None:
+                # a stopped ponder search ends first, so it doesn't slow the AI's search down
+                if self.ponder_done():
+                    self.start_search()
+            elif self.search.done() and time.time() - self.search_start >= wait:
+                self.finish_search()
+        elif PONDER and self.winning is None and len(AI_PLAYER) == 1:
+            self.ponder()
 
         if not (self.winning is None):
             if mouse_down and self.new_game_text.is_hovered(events):
                 self.new_game()
 
+    def record_game(self):
+        if GAME_LOG is None:
+            return
+        names = {player: player_name(ENGINE, DEPTHS[player], TIME_LIMITS[player]) if player in AI_PLAYER else "human"
+                 for player in (TILE_BLUE, TILE_RED)}
+        write_game(GAME_LOG, GameRecord(self.winning, names[TILE_BLUE], names[TILE_RED], self.plies))
+
     def display_tile_on_mouse(self, surface, tile, mouse_pos):
         x, y = mouse_pos
         w, h = self.tile_filled_width, self.tile_filled_height
@@ -246,7 +513,9 @@ class Game:
 
     def release_tile(self, x, y):
         move = [self.held_tile[2]*Board.WIDTH+self.held_tile[1], y*Board.WIDTH+x]
-        if move in self.board.get_valid_moves(TILE_BLUE) or move in self.board.get_valid_moves(TILE_RED):
+        if self.board.is_valid_move(self.player, move):
             self.board.perform_move(self.player, move)
+            self.plies.append(Ply(*move, ms=1000 * (time.time() - self.turn_start)))
             self.switch_player()
+            self.stop_pondering(move)
         self.held_tile = None
@@ -0,0 +1,133 @@
+"""
+Append-only file of finished games. After a file header every game is a
+fixed-size game record, the names of the players and one fixed-size record
+per ply, so a reader can skip a game it doesn't want without unpacking its
+moves. All numbers are little-endian.
+"""
+import argparse
+import os
+import struct
+import time
+from collections import Counter, namedtuple
+from board import Board, BLUE, RED
+
+MAGIC = b"13GL"
+VERSION = 2
+# magic, version
+FILE_HEADER = struct.Struct("<4sH2x")
+# plies, plies of the opening that weren't searched (random or set up), winner
+# (1 blue, 2 red), unix time the game ended, bytes of the blue and red player's
+# names, which follow as UTF-8
+GAME = struct.Struct("<BBBxIHH")
+# from square, to square, search depth (0 for moves that weren't searched),
+# score for red, milliseconds, nodes
+PLY = struct.Struct("<BBBxfII")
+
+GameRecord = namedtuple("GameRecord", ["winner", "blue", "red", "plies", "opening_plies", "time"], defaults=(0, 0))
+Ply = namedtuple("Ply", ["from_tile", "to_tile", "score", "depth", "ms", "nodes"], defaults=(0.0, 0, 0, 0))
+
+
+def player_name(engine, depth=None, time_ms=None, weights=None):
+    """
+    Name of an AI player in the form `tournament.parse_player` reads.
+    """
+    options = [engine]
+    if depth is not None:
+        options.append(f"depth={depth}")
+    if time_ms is not None:
+        options.append(f"time={time_ms}")
+    if weights is not None:
+        options.append(f"weights={weights}")
+    return ",".join(options)
+
+
+def write_game(path, game):
+    """
+    Appends a `GameRecord` to the file at `path`, creating it if needed.
+    The game is written with a single call, so games written one after
+    another by different processes don't mix.
+    """
+    blue, red = game.blue.encode(), game.red.encode()
+    data = [GAME.pack(len(game.plies), game.opening_plies, 1 if game.winner == BLUE else 2, int(game.time or time.time()),
+                      len(blue), len(red)), blue, red]
+    for ply in game.plies:
+        data.append(PLY.pack(ply.from_tile, ply.to_tile, ply.depth, ply.score, int(ply.ms), ply.nodes))
+    with open(path, "ab") as f:
+        if f.tell() == 0:
+            data.insert(0, FILE_HEADER.pack(MAGIC, VERSION))
+        f.write(b"".join(data))
+
+
+def read_games(path, winner=None, player=None, blue=None, red=None, opening=None):
+    """
+    Yields the `GameRecord`s of the file one at a time, so files of any
+    size can be gone through. Only games matching every filter given are
+    read: won by `winner` (`board.BLUE` or `board.RED`), played by
+    `player` on either side or by `blue`/`red` on that side, or starting
+    with the `(from, to)` moves of `opening`. A game cut short by a writer
+    that died ends the file.
+    """
+    opening = [tuple(move) for move in opening] if opening is not None else None
+    with open(path, "rb") as f:
+        magic, version = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a game log")
+        while True:
+            data = f.read(GAME.size)
+            if len(data) < GAME.size:
+                return
+            plies, opening_plies, game_winner, end_time, blue_size, red_size = GAME.unpack(data)
+            game_winner = BLUE if game_winner == 1 else RED
+            names = f.read(blue_size + red_size)
+            if len(names) < blue_size + red_size:
+                return
+            blue_name = names[:blue_size].decode()
+            red_name = names[blue_size:].decode()
+            if ((winner is not None and game_winner != winner) or (player is not None and player not in (blue_name, red_name))
+                    or (blue is not None and blue_name != blue) or (red is not None and red_name != red)
+                    or (opening is not None and plies < len(opening))):
+                f.seek(plies * PLY.size, os.SEEK_CUR)
+                continue
+            data = f.read(plies * PLY.size)
+            if len(data) < plies * PLY.size:
+                return
+            moves = [Ply(from_tile, to_tile, score, depth, ms, nodes) for from_tile, to_tile, depth, score, ms, nodes in PLY.iter_unpack(data)]
+            if opening is not None and [(ply.from_tile, ply.to_tile) for ply in moves[:len(opening)]] != opening:
+                continue
+            yield GameRecord(game_winner, blue_name, red_name, moves, opening_plies, end_time)
+
+
+def replay(game):
+    """
+    Yields `(board, moves, ply)` for every ply of the game, the board being
+    the position before the ply and `moves` the number of moves played.
+    The same board is changed in place between steps.
+    """
+    board = Board.new()
+    for moves, ply in enumerate(game.plies):
+        yield board, moves, ply
+        board.perform_move(RED if moves % 2 == 1 else BLUE, [ply.from_tile, ply.to_tile])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the games of a game log.")
+    parser.add_argument("path")
+    parser.add_argument("--winner", choices=("blue", "red"), default=None)
+    parser.add_argument("--player", default=None, help="only games this player played, e.g. `bitboard,depth=8`")
+    args = parser.parse_args()
+
+    winner = {"blue": BLUE, "red": RED, None: None}[args.winner]
+    games = Counter()
+    wins = Counter()
+    plies = 0
+    for game in read_games(args.path, winner=winner, player=args.player):
+        games[game.blue, game.red] += 1
+        wins[game.blue, game.red, game.winner] += 1
+        plies += len(game.plies)
+    print(f"{sum(games.values())} games, {plies} plies")
+    for (blue, red), count in games.most_common():
+        print(f"{blue} vs {red}: {count} games, blue won {wins[blue, red, BLUE]}, red won {wins[blue, red, RED]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,8 @@ from game import Game
 import pygame
 
 
-LIGHT_GRAY = (240, 240, 240)
+# Frames drawn per second at most, so the window leaves the CPU to the AI
+FPS = 60
 
 
 def main():
@@ -13,6 +14,7 @@ def main():
 
     game = Game.new(50, 150, x_center=300)
 
+    clock = pygame.time.Clock()
     running = True
     while running:
         events = Events.update()
@@ -20,10 +22,11 @@ def main():
         if events.quit:
             running = False
 
-        screen.fill(LIGHT_GRAY)
         game.update(events, screen)
-        game.display(screen, events)
-        pygame.display.flip()
+        pygame.display.update(game.display(screen, events))
+        clock.tick(FPS)
+
+    game.quit()
 
 
 if __name__ == "__main__":
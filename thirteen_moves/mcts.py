@@ -0,0 +1,296 @@
+"""
+Monte Carlo tree search (UCT) engine, `ai.play(..., engine="mcts")`.
+Leaves are picked with UCT and finished with random playouts. The playouts
+are run in batches, split between the workers of an executor if there is
+one. The tree is kept between calls and the part below the new position
+is reused.
+"""
+import math
+import random
+import time
+from array import array
+from collections import deque
+import bitboard
+from ai import LAST_MOVE, SearchResult
+from bitboard import RED_LAST_STEP, BLUE_LAST_STEP
+
+# Exploration constant of UCT
+EXPLORATION = 0.8
+# Leaves picked before their playouts are run, a leaf waiting for its playout
+# counts as lost so the leaves of one batch spread over the tree
+BATCH_SIZE = 32
+# Batches sent to an executor's workers at once. The playouts of one set run
+# while the leaves of the next are picked.
+EXECUTOR_BATCHES = 8
+# Playouts of a search to `depth`, so deeper settings search longer like they
+# do for the other engines
+PLAYOUTS_PER_DEPTH = 1000
+# Nodes are no longer added once the tree has this many
+MAX_NODES = 2_000_000
+# Plies a reused tree may be behind the position searched
+REUSE_PLIES = 2
+
+# Kept between `play` calls like `ai.transposition_table`
+tree = None
+
+
+class Tree:
+    """
+    Search tree stored column-wise in typed arrays indexed by node, node 0
+    being the root. The children of a node are numbered consecutively from
+    `first_child[node]` on, `first_child` is -1 until a node is expanded.
+    `wins` counts the playouts won by the side that moved into the node.
+    """
+    def __init__(self, position, maximizing_player, moves):
+        self.position = position
+        self.maximizing_player = maximizing_player
+        self.moves = moves
+        # from_square * 32 + to_square
+        self.move = array("H")
+        self.first_child = array("i")
+        self.child_count = array("B")
+        self.visits = array("I")
+        self.wins = array("I")
+        self.add(0)
+
+    def __len__(self):
+        return len(self.visits)
+
+    def add(self, move, visits=0, wins=0):
+        self.move.append(move)
+        self.first_child.append(-1)
+        self.child_count.append(0)
+        self.visits.append(visits)
+        self.wins.append(wins)
+
+    def expand(self, node, valid_moves):
+        self.first_child[node] = len(self)
+        self.child_count[node] = len(valid_moves)
+        for from_tile, to_tile in valid_moves:
+            self.add(from_tile << 5 | to_tile)
+
+    def children(self, node):
+        first = self.first_child[node]
+        if first < 0:
+            return range(0)
+        return range(first, first + self.child_count[node])
+
+    def move_of(self, node):
+        return self.move[node] >> 5, self.move[node] & 31
+
+    def find(self, position, maximizing_player, moves):
+        """
+        Node of the position if it is in the top `REUSE_PLIES` plies of the
+        tree, else `None`.
+        """
+        plies = moves - self.moves
+        if not 0 <= plies <= REUSE_PLIES or (self.maximizing_player != maximizing_player) != (plies % 2 == 1):
+            return None
+        frontier = [(0, self.position)]
+        side = self.maximizing_player
+        for _ in range(plies):
+            frontier = [(child, bitboard.perform_move(node_position, side, self.move_of(child)))
+                        for node, node_position in frontier for child in self.children(node)]
+            side = not side
+        for node, node_position in frontier:
+            if node_position == position:
+                return node
+        return None
+
+    def subtree(self, node, position, maximizing_player, moves):
+        """
+        Copy of the tree below `node`, which is at the given position.
+        """
+        copy = Tree(position, maximizing_player, moves)
+        copy.visits[0] = self.visits[node]
+        copy.wins[0] = self.wins[node]
+        queue = deque([(node, 0)])
+        while queue:
+            old, new = queue.popleft()
+            children = self.children(old)
+            if not children:
+                continue
+            copy.first_child[new] = len(copy)
+            copy.child_count[new] = len(children)
+            for child in children:
+                queue.append((child, len(copy)))
+                copy.add(self.move[child], self.visits[child], self.wins[child])
+        return copy
+
+
+def playout(position, maximizing_player, moves, rng):
+    """
+    Plays random moves until the game is over, returns the winner like
+    `bitboard.is_winning` does. A side that can move a tile to the last row
+    always does, and a side that can't stop the other from doing so next
+    loses straight away, which makes playouts much closer to real games.
+    """
+    while True:
+        winner = bitboard.is_winning(position)
+        if winner:
+            return winner
+        if moves > LAST_MOVE:
+            return 2
+        if maximizing_player:
+            own, threats, loss = position[1], position[0] & BLUE_LAST_STEP, 1
+            if own & RED_LAST_STEP:
+                return 2
+        else:
+            own, threats, loss = position[0], position[1] & RED_LAST_STEP, 2
+            if own & BLUE_LAST_STEP:
+                return 1
+        if threats:
+            # only taking the tile about to arrive saves the game
+            valid_moves = [move for move in bitboard.get_valid_moves(position, maximizing_player) if threats >> move[1] & 1]
+            if not valid_moves or threats & (threats - 1):
+                return loss
+            move = rng.choice(valid_moves)
+        else:
+            move = bitboard.random_move(position, maximizing_player, rng)
+        position = bitboard.perform_move(position, maximizing_player, move)
+        maximizing_player = not maximizing_player
+        moves += 1
+
+
+def playouts(leaves, seed):
+    """
+    `playout` of every `(position, maximizing_player, moves)` in `leaves`,
+    run by the executor's workers.
+    """
+    rng = random.Random(seed)
+    return [playout(position, maximizing_player, moves, rng) for position, maximizing_player, moves in leaves]
+
+
+def select(tree):
+    """
+    Walks down from the root by UCT to a node without playouts, expanding
+    the node it stops at if it already has some. Counts a visit to every
+    node on the way. Returns the path and the leaf's position, side to move
+    and move count.
+    """
+    node = 0
+    position, maximizing_player, moves = tree.position, tree.maximizing_player, tree.moves
+    path = [0]
+    visits, wins = tree.visits, tree.wins
+    while True:
+        visits[node] += 1
+        if bitboard.is_winning(position) or moves > LAST_MOVE:
+            return path, position, maximizing_player, moves
+        children = tree.children(node)
+        if not children:
+            if visits[node] == 1 or len(tree) >= MAX_NODES:
+                return path, position, maximizing_player, moves
+            tree.expand(node, bitboard.get_valid_moves(position, maximizing_player))
+            children = tree.children(node)
+
+        log_visits = math.log(visits[node])
+        best_value = -1.0
+        for child in children:
+            n = visits[child]
+            if n == 0:
+                best = child
+                break
+            value = wins[child] / n + EXPLORATION * math.sqrt(log_visits / n)
+            if value > best_value:
+                best_value = value
+                best = child
+
+        position = bitboard.perform_move(position, maximizing_player, tree.move_of(best))
+        maximizing_player = not maximizing_player
+        moves += 1
+        node = best
+        path.append(node)
+
+
+def backpropagate(tree, path, winner):
+    red_won = winner == 2
+    # whether red made the move into the node, the root's move was the other side's
+    moved = not tree.maximizing_player
+    for node in path:
+        if moved == red_won:
+            tree.wins[node] += 1
+        moved = not moved
+
+
+def backpropagate_batch(tree, paths, results):
+    """
+    `backpropagate` of every path, `results` being the winners of the
+    paths' playouts in lists of consecutive paths.
+    """
+    winners = (winner for winners in results for winner in winners)
+    for path, winner in zip(paths, winners):
+        backpropagate(tree, path, winner)
+
+
+def principal_variation(tree):
+    """
+    Most visited child of every node from the root down.
+    """
+    variation = []
+    node = 0
+    while tree.children(node):
+        node = max(tree.children(node), key=tree.visits.__getitem__)
+        if tree.visits[node] == 0:
+            break
+        variation.append(node)
+    return variation
+
+
+def play(board, maximizing_player, moves, depth=None, time_ms=None, executor=None, seed=None, stats=None, stop=None):
+    """
+    Same contract as `ai.play`, except that the search runs
+    `depth * PLAYOUTS_PER_DEPTH` playouts, or as many as fit in `time_ms`
+    (no more than that if `depth` is given too). The score is red's
+    expected result between -1 and 1.
+    """
+    global tree
+    start = time.perf_counter()
+    position = bitboard.from_tiles(board.tiles)
+    node = None if tree is None else tree.find(position, maximizing_player, moves)
+    if node is None:
+        tree = Tree(position, maximizing_player, moves)
+    elif node != 0:
+        tree = tree.subtree(node, position, maximizing_player, moves)
+
+    limit = math.inf if depth is None else depth * PLAYOUTS_PER_DEPTH
+    if time_ms is None and depth is None:
+        raise ValueError("mcts needs a depth or a time limit")
+    deadline = math.inf if time_ms is None else start + time_ms / 1000
+    rng = random.Random(seed)
+    batch_size = BATCH_SIZE if executor is None else BATCH_SIZE * EXECUTOR_BATCHES
+    done = 0
+    # playouts of the last batch sent to the executor, collected after the next batch is picked
+    pending = None
+    # at least one batch, so there is a move to play
+    while done == 0 or (done < limit and time.perf_counter() < deadline and not (stop is not None and stop.value)):
+        paths = []
+        leaves = []
+        for _ in range(min(batch_size, limit - done)):
+            path, *leaf = select(tree)
+            paths.append(path)
+            leaves.append(leaf)
+        if executor is None:
+            backpropagate_batch(tree, paths, [playouts(leaves, rng.getrandbits(32))])
+        else:
+            chunks = [leaves[i:i + BATCH_SIZE] for i in range(0, len(leaves), BATCH_SIZE)]
+            results = executor.map(playouts, chunks, [rng.getrandbits(32) for _ in chunks])
+            if pending is not None:
+                backpropagate_batch(tree, *pending)
+            pending = paths, results
+        done += len(leaves)
+    if pending is not None:
+        backpropagate_batch(tree, *pending)
+
+    variation = principal_variation(tree)
+    best = variation[0]
+    win_rate = tree.wins[best] / tree.visits[best] if tree.visits[best] else 0.5
+    score = 2 * win_rate - 1 if maximizing_player else 1 - 2 * win_rate
+
+    from_tile, to_tile = tree.move_of(best)
+    player_tiles = board.tiles[1] if maximizing_player else board.tiles[0]
+    if stats is not None:
+        stats.nodes = done
+        stats.seconds = time.perf_counter() - start
+        # one record for the whole search, its depth being the principal variation's
+        stats.depths.append(dict(depth=len(variation), nodes=done, seconds=stats.seconds, score=score, searches=1, finished=True))
+    return SearchResult([player_tiles.index(from_tile), to_tile], score, len(variation), done, stats)
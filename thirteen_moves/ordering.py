@@ -0,0 +1,77 @@
+import random
+from board import Board
+
+SQUARES = Board.WIDTH * Board.HEIGHT
+LAST_ROW = Board.HEIGHT - 1
+# plies in a game, 13 moves each
+GAME_PLIES = 26
+
+# Move classes in the order they are searched, above any history score
+CAPTURE = 1 << 42
+PROMOTION = 1 << 41
+KILLER = 1 << 40
+
+# PROMOTION_SCORES[maximizing_player][to_tile]
+PROMOTION_SCORES = [[PROMOTION if to_tile // Board.WIDTH == row else 0 for to_tile in range(SQUARES)] for row in (0, LAST_ROW)]
+
+
+class MoveOrdering:
+    """
+    Move ordering state of one search. Moves are searched captures first,
+    then moves to the last row, then the killer moves of the same move
+    count (the last two quiet moves that caused a cutoff there), then by
+    history score (how much searching quiet moves with the same color and
+    tiles has caused cutoffs). The transposition table move goes before
+    all of them.
+
+    Ties keep move generation order, except at the root where the moves are
+    shuffled first with `random.Random(seed)`, so the same seed always
+    gives the same search.
+    """
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.killers = [[-1, -1] for _ in range(GAME_PLIES)]
+        self.history = [[0] * (SQUARES * SQUARES) for _ in range(2)]
+
+    def score(self, from_tile, to_tile, capture, maximizing_player, moves):
+        i = from_tile * SQUARES + to_tile
+        score = self.history[maximizing_player][i]
+        if capture:
+            score += CAPTURE
+        if to_tile // Board.WIDTH == (LAST_ROW if maximizing_player else 0):
+            score += PROMOTION
+        killers = self.killers[moves]
+        if i == killers[0] or i == killers[1]:
+            score += KILLER
+        return score
+
+    def square_scores(self, valid_moves, enemy, maximizing_player, moves):
+        """
+        `score` of every `(from_tile, to_tile)` move in `valid_moves`, with
+        `enemy` the bitboard of the tiles a move can take. Scores a whole
+        node at once for the bitboard engine.
+        """
+        history = self.history[maximizing_player]
+        promotion = PROMOTION_SCORES[maximizing_player]
+        scores = [history[from_tile * SQUARES + to_tile] + (enemy >> to_tile & 1) * CAPTURE + promotion[to_tile]
+                  for from_tile, to_tile in valid_moves]
+        for killer in self.killers[moves]:
+            if killer >= 0:
+                move = divmod(killer, SQUARES)
+                if move in valid_moves:
+                    scores[valid_moves.index(move)] += KILLER
+        return scores
+
+    def cutoff(self, from_tile, to_tile, capture, maximizing_player, moves, depth, index):
+        """
+        Called for the move that caused a beta cutoff, `index` is where the
+        move was in the search order.
+        """
+        if capture:
+            return
+        i = from_tile * SQUARES + to_tile
+        self.history[maximizing_player][i] += depth * depth
+        killers = self.killers[moves]
+        if killers[0] != i:
+            killers[1] = killers[0]
+            killers[0] = i
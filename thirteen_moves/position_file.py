@@ -0,0 +1,97 @@
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+MAGIC = b"13PF"
+VERSION = 1
+# magic, version, byte order, value typecode, kind, record count, 4 parameters of the kind
+HEADER = struct.Struct("<4sHcc4sQ4I")
+# keys start on a multiple of 8 bytes
+HEADER_SIZE = 48
+
+
+def write(path, kind, keys, values, typecode, params=()):
+    """
+    Writes a position file: a header followed by every key as an unsigned
+    64-bit integer, then every value as a `typecode` array item. `keys`
+    must be sorted, a key may appear more than once. `kind` is 4 bytes
+    telling what the file holds and `params` up to 4 unsigned ints that
+    go with it.
+    """
+    keys = array("Q", keys)
+    values = array(typecode, values)
+    if len(keys) != len(values):
+        raise ValueError("keys and values must have the same length")
+    params = tuple(params) + (0,) * (4 - len(params))
+
+    byteorder = b"<" if sys.byteorder == "little" else b">"
+    header = HEADER.pack(MAGIC, VERSION, byteorder, typecode.encode(), kind, len(keys), *params)
+    with open(path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        keys.tofile(f)
+        values.tofile(f)
+
+
+class PositionFile:
+    """
+    Read-only view of a file made by `write`. The file is memory-mapped and
+    `keys`/`values` are views straight into the mapping, so opening costs
+    the same for any file size and processes that open the same file share
+    its pages.
+    """
+    def __init__(self, path, kind=None):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, byteorder, typecode, file_kind, count, *params = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a position file")
+        if byteorder != (b"<" if sys.byteorder == "little" else b">"):
+            raise ValueError(f"{path} was written on a machine with a different byte order")
+        if kind is not None and file_kind != kind:
+            raise ValueError(f"{path} holds {file_kind.decode()} records, expected {kind.decode()}")
+
+        self.kind = file_kind
+        self.params = params
+        self._view = memoryview(self._mmap)
+        values_start = HEADER_SIZE + 8 * count
+        self.keys = self._view[HEADER_SIZE:values_start].cast("Q")
+        self.values = self._view[values_start:].cast(typecode.decode())
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, key):
+        """
+        Index of the first record with `key`, -1 if there is none.
+        """
+        keys = self.keys
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return i
+        return -1
+
+    def get(self, key, default=None):
+        i = self.find(key)
+        return default if i < 0 else self.values[i]
+
+    def get_all(self, key):
+        """
+        Values of every record with `key`.
+        """
+        keys = self.keys
+        i = bisect_left(keys, key)
+        result = []
+        while i < len(keys) and keys[i] == key:
+            result.append(self.values[i])
+            i += 1
+        return result
+
+    def close(self):
+        self.keys.release()
+        self.values.release()
+        self._view.release()
+        self._mmap.close()
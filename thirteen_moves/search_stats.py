@@ -0,0 +1,214 @@
+import argparse
+import cProfile
+import json
+import pstats
+import time
+import ai
+from board import Board
+from ordering import MoveOrdering
+
+
+class StatsOrdering(MoveOrdering):
+    """
+    `MoveOrdering` that also counts cutoffs for a `SearchStats`, so a
+    search without statistics runs the plain class and pays nothing.
+    """
+    def __init__(self, stats, seed=None):
+        super().__init__(seed)
+        self.stats = stats
+
+    def cutoff(self, from_tile, to_tile, capture, maximizing_player, moves, depth, index):
+        self.stats.cutoffs += 1
+        if index == 0:
+            self.stats.first_move_cutoffs += 1
+        super().cutoff(from_tile, to_tile, capture, maximizing_player, moves, depth, index)
+
+
+class SearchStats:
+    """
+    What one `play` call did. Pass one as `play(..., stats=SearchStats())`
+    and it is filled in and returned as `SearchResult.stats`. Nodes and
+    table counts are read from the transposition table's counters, cutoffs
+    are counted by `StatsOrdering` and the time and nodes of every depth
+    of iterative deepening by wrapping the search. The root moves an
+    executor's workers search are counted too (see `count_search`), once
+    they finish. The "mcts" engine fills in the nodes, its playouts, the
+    time and one record for the whole search.
+    """
+    def __init__(self):
+        self.nodes = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_stores = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.seconds = 0.0
+        # one dict per depth searched: depth, nodes, seconds, score, the number of
+        # searches (more than one if the aspiration window failed) and whether it finished
+        self.depths = []
+        self._tt = None
+        self._start = None
+        self._counters = None
+        # probes, hits and stores of the tables of workers
+        self._worker_counters = [0, 0, 0]
+
+    def ordering(self, seed=None):
+        return StatsOrdering(self, seed)
+
+    def start(self, tt):
+        self._tt = tt
+        self._start = time.perf_counter()
+        self._counters = tt.probes, tt.hits, tt.stores
+        self._worker_counters = [0, 0, 0]
+
+    def add_worker(self, counts):
+        """
+        Adds the `counts` of a part of the search a worker process ran, as
+        returned by `count_search`.
+        """
+        probes, hits, stores, cutoffs, first_move_cutoffs = counts
+        self._worker_counters[0] += probes
+        self._worker_counters[1] += hits
+        self._worker_counters[2] += stores
+        self.cutoffs += cutoffs
+        self.first_move_cutoffs += first_move_cutoffs
+
+    def _probes(self):
+        return self._tt.probes + self._worker_counters[0]
+
+    def wrap(self, search):
+        """
+        `search(depth, deadline, alpha, beta)` recording every depth.
+        """
+        def stats_search(depth, deadline=None, *window):
+            if not self.depths or self.depths[-1]["depth"] != depth:
+                self.depths.append(dict(depth=depth, nodes=0, seconds=0.0, score=None, searches=0, finished=False))
+            record = self.depths[-1]
+            probes = self._probes()
+            start = time.perf_counter()
+            try:
+                move, score = search(depth, deadline, *window)
+            finally:
+                record["nodes"] += self._probes() - probes
+                record["seconds"] += time.perf_counter() - start
+                record["searches"] += 1
+            record["score"] = score
+            record["finished"] = True
+            return move, score
+        return stats_search
+
+    def finish(self):
+        probes, hits, stores = self._counters
+        worker_probes, worker_hits, worker_stores = self._worker_counters
+        self.tt_probes = self._tt.probes - probes + worker_probes
+        self.tt_hits = self._tt.hits - hits + worker_hits
+        self.tt_stores = self._tt.stores - stores + worker_stores
+        self.nodes = self.tt_probes
+        self.seconds = time.perf_counter() - self._start
+        self._tt = None
+
+    @property
+    def branching_factor(self):
+        """
+        Effective branching factor: nodes of the deepest finished depth
+        over nodes of the one before, or the `depth`th root of the nodes
+        if only one depth finished.
+        """
+        finished = [record for record in self.depths if record["finished"] and record["nodes"]]
+        if len(finished) >= 2:
+            return finished[-1]["nodes"] / finished[-2]["nodes"]
+        if finished:
+            return finished[-1]["nodes"] ** (1 / finished[-1]["depth"])
+        return 0.0
+
+    def to_dict(self):
+        return {
+            "nodes": self.nodes,
+            "seconds": self.seconds,
+            "nps": self.nodes / self.seconds if self.seconds else 0,
+            "tt_probes": self.tt_probes,
+            "tt_hits": self.tt_hits,
+            "tt_stores": self.tt_stores,
+            "cutoffs": self.cutoffs,
+            "first_move_cutoffs": self.first_move_cutoffs,
+            "branching_factor": self.branching_factor,
+            "depths": self.depths,
+        }
+
+
+def count_search(tt, search):
+    """
+    Runs `search(ordering)`, the part of a search with statistics that a
+    worker process runs with the table `tt`. Returns its result and the
+    counts to pass to `SearchStats.add_worker`.
+    """
+    stats = SearchStats()
+    stats.start(tt)
+    result = search(stats.ordering())
+    stats.finish()
+    return result, (stats.tt_probes, stats.tt_hits, stats.tt_stores, stats.cutoffs, stats.first_move_cutoffs)
+
+
+class JsonLinesWriter:
+    """
+    `ai.stats_hook` that appends the statistics of every move to `path`,
+    one JSON object a line.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, result, moves, maximizing_player):
+        line = dict(time=time.time(), moves=moves, player="red" if maximizing_player else "blue",
+                    move=result.move, score=result.score, depth=result.depth)
+        if result.stats is not None:
+            line.update(result.stats.to_dict())
+        with open(self.path, "a") as f:
+            f.write(json.dumps(line) + "\n")
+
+
+def profile_play(*args, out=None, **kwargs):
+    """
+    Calls `ai.play(*args, **kwargs)` under cProfile. Returns the result and
+    the `pstats.Stats` of the call, which are also written to `out` if it
+    is given (for snakeviz and other viewers).
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(ai.play, *args, **kwargs)
+    if out is not None:
+        profiler.dump_stats(out)
+    return result, pstats.Stats(profiler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the start position once and print what the search did.")
+    parser.add_argument("--engine", choices=("list", "bitboard"), default="bitboard")
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--time", type=int, default=None, help="milliseconds to deepen iteratively for")
+    parser.add_argument("--profile", nargs="?", const="", default=None, metavar="FILE",
+                        help="run under cProfile and print the slowest functions, or write the profile to FILE")
+    args = parser.parse_args()
+    if args.depth is None and args.time is None:
+        args.depth = 8
+
+    stats = SearchStats()
+    kwargs = dict(depth=args.depth, engine=args.engine, time_ms=args.time, stats=stats)
+    if args.profile is None:
+        result = ai.play(Board.new(), False, 0, **kwargs)
+    else:
+        result, profile = profile_play(Board.new(), False, 0, out=args.profile or None, **kwargs)
+        profile.sort_stats("cumulative").print_stats(25)
+
+    print(f"move {result.move}, score {result.score:.2f}, depth {result.depth}")
+    print(f"{stats.nodes} nodes in {stats.seconds:.3f}s, {stats.to_dict()['nps']:.0f} nps, "
+          f"branching factor {stats.branching_factor:.2f}")
+    hit_rate = stats.tt_hits / stats.tt_probes if stats.tt_probes else 0
+    first_rate = stats.first_move_cutoffs / stats.cutoffs if stats.cutoffs else 0
+    print(f"table: {stats.tt_probes} probes, {hit_rate:.1%} hits, {stats.tt_stores} stores")
+    print(f"cutoffs: {stats.cutoffs}, {first_rate:.1%} by the first move")
+    for record in stats.depths:
+        print(f"depth {record['depth']:>2}: {record['nodes']:>8} nodes {record['seconds']:7.3f}s  searches {record['searches']}"
+              + ("" if record["finished"] else "  (timed out)"))
+
+
+if __name__ == "__main__":
+    main()
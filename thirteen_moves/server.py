@@ -0,0 +1,472 @@
+"""
+Headless engine server speaking a line protocol over stdin/stdout and,
+with `--port`, TCP. Every request carries the whole position, so one
+connection can play any number of games at once.
+
+Requests:
+
+    go <id> <blue tiles> <red tiles> <moves> [depth <n>] [time <ms>] [engine list|bitboard|mcts]
+        Searches the position with `moves` moves played, the side to move
+        follows from it. Tiles are comma separated squares (y * 5 + x) as
+        in `Board.tiles`, `-` for none. `id` is any word naming the request.
+    stop <id>
+        Ends the search early, it answers with the best move found so far.
+    isready
+    quit
+
+Answers:
+
+    info <id> depth <d> score <score> nodes <n> time <ms>
+        After every depth of the search.
+    bestmove <id> <from tile> <to tile> score <score> depth <d> nodes <n>
+    cancelled <id>
+        A request stopped before it was searched.
+    readyok
+    error <id or -> <message>
+"""
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import ai
+from ai import LAST_MOVE
+from board import Board
+from search_stats import SearchStats
+from tablebase import load_tablebase
+from book import load_book
+from weights import load_weights
+
+SQUARES = Board.WIDTH * Board.HEIGHT
+ENGINES = ("list", "bitboard", "mcts")
+
+
+class InfoStats(SearchStats):
+    """
+    `SearchStats` that sends an info message after every depth.
+    """
+    def __init__(self, conn, token):
+        super().__init__()
+        self.conn = conn
+        self.token = token
+
+    def wrap(self, search):
+        stats_search = super().wrap(search)
+
+        def info_search(depth, deadline=None, *window):
+            move, score = stats_search(depth, deadline, *window)
+            record = self.depths[-1]
+            self.conn.send(("info", self.token, depth, score, record["nodes"], record["seconds"]))
+            return move, score
+        return info_search
+
+
+def worker_main(conn, stop, tablebase, book, weights):
+    """
+    Runs searches sent over `conn` until it receives `None`. The tables of
+    the engines and the tablebase are kept for the whole process, so every
+    game the worker searches shares them.
+    """
+    # ctrl-c is the server's to handle
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if weights is not None:
+        load_weights(weights)
+    if tablebase is not None:
+        load_tablebase(tablebase)
+    if book is not None:
+        load_book(book)
+
+    while True:
+        job = conn.recv()
+        if job is None:
+            return
+        token, tiles, moves, depth, time_ms, engine = job
+        maximizing_player = moves % 2 == 1
+        try:
+            result = ai.play(Board(tiles), maximizing_player, moves, depth=depth, engine=engine, time_ms=time_ms,
+                             stats=InfoStats(conn, token), stop=stop)
+        except Exception as e:
+            conn.send(("error", token, f"search failed: {e!r}"))
+            continue
+        player_tiles = tiles[1] if maximizing_player else tiles[0]
+        conn.send(("bestmove", token, player_tiles[result.move[0]], result.move[1], result.score, result.depth, result.nodes))
+
+
+def parse_tiles(text):
+    if text == "-":
+        return []
+    tiles = [int(tile) for tile in text.split(",")]
+    if any(not 0 <= tile < SQUARES for tile in tiles) or len(set(tiles)) != len(tiles):
+        raise ValueError(f"bad tiles {text!r}")
+    return tiles
+
+
+def parse_go(args, default_time, max_time):
+    """
+    Reads the arguments of a `go` request after its id into
+    `(tiles, moves, depth, time_ms, engine)`, raises `ValueError` if
+    they aren't a position that can be searched.
+    """
+    if len(args) < 3:
+        raise ValueError("go needs blue tiles, red tiles and the move count")
+    tiles = parse_tiles(args[0]), parse_tiles(args[1])
+    if set(tiles[0]) & set(tiles[1]):
+        raise ValueError("blue and red tiles overlap")
+    moves = int(args[2])
+    if not 0 <= moves <= LAST_MOVE:
+        raise ValueError(f"move count must be between 0 and {LAST_MOVE}")
+    if ai.is_winning(tiles):
+        raise ValueError("the game is over")
+
+    options = dict(zip(args[3::2], args[4::2]))
+    if len(args[3:]) % 2 or set(options) - {"depth", "time", "engine"}:
+        raise ValueError("options are depth <n>, time <ms> and engine <name>")
+    depth = int(options["depth"]) if "depth" in options else None
+    if depth is not None and depth < 1:
+        raise ValueError("depth must be at least 1")
+    time_ms = min(int(options.get("time", default_time)), max_time)
+    engine = options.get("engine", "bitboard")
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine {engine!r}")
+    return tiles, moves, depth, time_ms, engine
+
+
+class Job:
+    def __init__(self, client, request_id, tiles, moves, depth, time_ms, engine):
+        self.client = client
+        self.request_id = request_id
+        self.tiles = tiles
+        self.moves = moves
+        self.depth = depth
+        self.time_ms = time_ms
+        self.engine = engine
+        # the stop flag of the worker while the job is running
+        self.stop = None
+
+
+class Scheduler:
+    """
+    Queue of jobs that hands them out round robin by client, so a client
+    sending many requests at once doesn't hold up the others.
+    """
+    def __init__(self):
+        self.queues = {}
+        self.clients = deque()
+        self.changed = asyncio.Condition()
+
+    async def put(self, job):
+        async with self.changed:
+            if job.client not in self.queues:
+                self.queues[job.client] = deque()
+                self.clients.append(job.client)
+            self.queues[job.client].append(job)
+            self.changed.notify()
+
+    async def get(self):
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.clients)
+            client = self.clients.popleft()
+            queue = self.queues[client]
+            job = queue.popleft()
+            if queue:
+                self.clients.append(client)
+            else:
+                del self.queues[client]
+            return job
+
+    def clear(self):
+        """
+        Takes every job out of the queue and returns them.
+        """
+        jobs = [job for queue in self.queues.values() for job in queue]
+        self.queues.clear()
+        self.clients.clear()
+        return jobs
+
+    def remove(self, job):
+        """
+        Takes a job out of the queue, `False` if it wasn't queued.
+        """
+        queue = self.queues.get(job.client)
+        if queue is None or job not in queue:
+            return False
+        queue.remove(job)
+        if not queue:
+            del self.queues[job.client]
+            self.clients.remove(job.client)
+        return True
+
+
+class Client:
+    def __init__(self, writer):
+        self.writer = writer
+        # jobs queued or running by request id
+        self.jobs = {}
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def send(self, line):
+        if not self.writer.is_closing():
+            self.writer.write(line.encode() + b"\n")
+
+    def finish(self, job):
+        if self.jobs.get(job.request_id) is job:
+            del self.jobs[job.request_id]
+        if not self.jobs:
+            self.idle.set()
+
+
+class EngineServer:
+    def __init__(self, workers, tablebase=None, book=None, default_time=1000, max_time=10000, max_jobs=256, weights=None):
+        self.workers = workers
+        self.tablebase = tablebase
+        self.book = book
+        self.weights = weights
+        self.default_time = default_time
+        self.max_time = max_time
+        # queued and running requests a client may have at once
+        self.max_jobs = max_jobs
+        self.scheduler = None
+        self.tokens = itertools.count()
+        self.processes = []
+        self.tasks = []
+        # workers whose process hasn't died
+        self.live_workers = 0
+        # threads waiting for the workers' messages, one per worker
+        self.receivers = ThreadPoolExecutor(workers)
+        self.closed = None
+
+    def start(self):
+        self.scheduler = Scheduler()
+        self.closed = asyncio.Event()
+        for _ in range(self.workers):
+            conn, worker_conn = multiprocessing.Pipe()
+            stop = multiprocessing.Value("b", 0, lock=False)
+            process = multiprocessing.Process(target=worker_main, args=(worker_conn, stop, self.tablebase, self.book, self.weights),
+                                              daemon=True)
+            process.start()
+            self.processes.append((process, conn))
+            self.live_workers += 1
+            self.tasks.append(asyncio.create_task(self.run_worker(conn, stop)))
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        for process, conn in self.processes:
+            # a search still running ends at its time limit
+            if process.is_alive():
+                conn.send(None)
+        loop = asyncio.get_running_loop()
+        for process, _ in self.processes:
+            await loop.run_in_executor(self.receivers, process.join)
+        self.receivers.shutdown()
+
+    async def run_worker(self, conn, stop):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.scheduler.get()
+            token = next(self.tokens)
+            # reset before the job is sent, a stop for the previous job may have come in after it ended
+            stop.value = 0
+            job.stop = stop
+            try:
+                conn.send((token, job.tiles, job.moves, job.depth, job.time_ms, job.engine))
+            except OSError:
+                self.worker_died(job)
+                return
+            while True:
+                try:
+                    message = await loop.run_in_executor(self.receivers, conn.recv)
+                except EOFError:
+                    self.worker_died(job)
+                    return
+                kind, message_token, *values = message
+                if message_token != token:
+                    continue
+                if kind == "info":
+                    depth, score, nodes, seconds = values
+                    job.client.send(f"info {job.request_id} depth {depth} score {score:.2f} nodes {nodes} time {seconds * 1000:.0f}")
+                    continue
+                if kind == "bestmove":
+                    from_tile, to_tile, score, depth, nodes = values
+                    job.client.send(f"bestmove {job.request_id} {from_tile} {to_tile} score {score:.2f} depth {depth} nodes {nodes}")
+                else:
+                    job.client.send(f"error {job.request_id} {values[0]}")
+                break
+            job.stop = None
+            job.client.finish(job)
+
+    def worker_died(self, job):
+        """
+        Answers the job of a worker whose process died. The other workers take
+        the queued jobs, once none is left they are answered too.
+        """
+        job.stop = None
+        job.client.send(f"error {job.request_id} worker died")
+        job.client.finish(job)
+        self.live_workers -= 1
+        if not self.live_workers:
+            for queued in self.scheduler.clear():
+                queued.client.send(f"error {queued.request_id} no workers left")
+                queued.client.finish(queued)
+
+    def stop_job(self, job):
+        if self.scheduler.remove(job):
+            job.client.send(f"cancelled {job.request_id}")
+            job.client.finish(job)
+        elif job.stop is not None:
+            job.stop.value = 1
+
+    async def handle(self, reader, writer, stdio=False):
+        """
+        Serves one connection until it sends `quit` or closes. The stdin/stdout
+        connection waits for its searches to finish when stdin closes, `quit`
+        on it stops the server.
+        """
+        client = Client(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                words = line.decode(errors="replace").split()
+                if not words:
+                    continue
+                command, args = words[0], words[1:]
+                if command == "quit":
+                    if stdio:
+                        self.closed.set()
+                    break
+                elif command == "isready":
+                    client.send("readyok")
+                elif command == "go":
+                    await self.go(client, args)
+                elif command == "stop":
+                    if not args:
+                        client.send("error - stop needs a request id")
+                    elif args[0] in client.jobs:
+                        self.stop_job(client.jobs[args[0]])
+                    else:
+                        client.send(f"error {args[0]} no such request")
+                else:
+                    client.send(f"error - unknown command {command!r}")
+                await writer.drain()
+
+            if stdio:
+                await client.idle.wait()
+        finally:
+            for job in list(client.jobs.values()):
+                self.stop_job(job)
+            if not stdio:
+                writer.close()
+
+    async def go(self, client, args):
+        if not args:
+            client.send("error - go needs a request id")
+            return
+        request_id = args[0]
+        if request_id in client.jobs:
+            client.send(f"error {request_id} request id already in use")
+            return
+        if not self.live_workers:
+            client.send(f"error {request_id} no workers left")
+            return
+        if len(client.jobs) >= self.max_jobs:
+            client.send(f"error {request_id} too many requests at once")
+            return
+        try:
+            tiles, moves, depth, time_ms, engine = parse_go(args[1:], self.default_time, self.max_time)
+        except ValueError as e:
+            client.send(f"error {request_id} {e}")
+            return
+        job = Job(client, request_id, tiles, moves, depth, time_ms, engine)
+        client.jobs[request_id] = job
+        client.idle.clear()
+        await self.scheduler.put(job)
+
+
+class StdinReader:
+    """
+    `readline` of stdin for `EngineServer.handle`. asyncio can't wait on
+    stdin when it is a file, so a daemon thread reads it, one that doesn't
+    keep the server from exiting while it waits for input.
+    """
+    def __init__(self):
+        self.lines = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+
+        def read():
+            for line in iter(sys.stdin.buffer.readline, b""):
+                loop.call_soon_threadsafe(self.lines.put_nowait, line)
+            loop.call_soon_threadsafe(self.lines.put_nowait, b"")
+        threading.Thread(target=read, daemon=True).start()
+
+    async def readline(self):
+        return await self.lines.get()
+
+
+class StdoutWriter:
+    """
+    The parts of `asyncio.StreamWriter` `EngineServer.handle` uses, for
+    stdout. Lines are short, so they are written straight away.
+    """
+    def write(self, data):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+    async def drain(self):
+        pass
+
+    def is_closing(self):
+        return False
+
+    def close(self):
+        pass
+
+
+async def serve(args):
+    engine = EngineServer(args.workers, args.tablebase, args.book, args.default_time, args.max_time, weights=args.weights)
+    engine.start()
+    try:
+        if args.port is not None:
+            server = await asyncio.start_server(engine.handle, args.host, args.port)
+            print(f"listening on {args.host}:{args.port}", file=sys.stderr, flush=True)
+        if not args.no_stdio:
+            stdio = asyncio.create_task(engine.handle(StdinReader(), StdoutWriter(), stdio=True))
+            if args.port is None:
+                stdio.add_done_callback(lambda _: engine.closed.set())
+        await engine.closed.wait()
+        if args.port is not None:
+            server.close()
+    finally:
+        await engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve engine searches over stdin/stdout and TCP, see the module docstring for the protocol.")
+    parser.add_argument("--port", type=int, default=None, help="also listen for TCP connections on this port")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--no-stdio", action="store_true", help="only serve TCP connections")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="searches run at once")
+    parser.add_argument("--default-time", type=int, default=1000, help="milliseconds per search if a request gives no time")
+    parser.add_argument("--max-time", type=int, default=10000, help="milliseconds a search may take at most")
+    parser.add_argument("--tablebase", default="tablebase.bin")
+    parser.add_argument("--book", default=None, help="opening book to answer from, none by default")
+    parser.add_argument("--weights", default="weights.json", help="evaluation weights, see tune.py, used if the file exists")
+    args = parser.parse_args()
+    if args.no_stdio and args.port is None:
+        parser.error("--no-stdio needs --port")
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
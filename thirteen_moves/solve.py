@@ -0,0 +1,354 @@
+"""
+Solves the game from the start position: finds out who wins with perfect
+play and which moves keep the win. The positions `--split` plies in are
+work units searched to the end of the game by a pool of processes. Each
+solved unit is appended to a checkpoint file, so a stopped run picks up
+where it left off. The proven moves are written as an opening book (see
+`book`) that `ai.play` then plays from.
+
+    python3 solve.py --split 6 --workers 8
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import ai
+import bitboard
+import book
+import position_file
+from ai import LAST_MOVE, SearchTimeout
+from bitboard import WIDTH, HEIGHT, TOP_ROW, RED_LAST_STEP, BLUE_LAST_STEP
+from board import Board
+from tablebase import load_tablebase
+
+# Score of a proven win in the book, positive if red wins. Like the `sign*10`
+# of `bitboard.negamax`, the win's distance isn't known.
+WIN_SCORE = 10
+# Book depth recorded for solved positions, a search to the end of the game
+SOLVED_DEPTH = LAST_MOVE + 2
+# The table of a worker is cleared when it has this many positions
+MAX_TABLE = 2_000_000
+
+# ROW_MASKS[r] has the squares of row r
+ROW_MASKS = [TOP_ROW << (WIDTH * r) for r in range(HEIGHT)]
+
+# Solved positions of a worker, `position_key` -> whether red wins
+table = {}
+# Positions visited by the worker since the last unit
+nodes = 0
+# Set by `solve` once the units still running aren't needed
+stop = None
+
+
+def init_worker(tablebase, stop_flag):
+    global stop
+    stop = stop_flag
+    load_tablebase(tablebase)
+
+
+def blue_moves_left(moves):
+    # blue plays the even moves up to LAST_MOVE
+    return (LAST_MOVE - moves) // 2 + 1 if moves <= LAST_MOVE else 0
+
+
+def blue_lost(position, moves):
+    """
+    Whether blue can no longer win: no blue tile can reach the first row
+    and blue can't take every red tile in the moves it has left.
+    """
+    blue, red = position
+    left = blue_moves_left(moves)
+    if red.bit_count() <= left:
+        return False
+    for r in range(min(left + 1, HEIGHT)):
+        if blue & ROW_MASKS[r]:
+            return False
+    return True
+
+
+def order_moves(position, maximizing_player, valid_moves):
+    """
+    Sorts `valid_moves` in place, captures and then the most advanced
+    tiles first. Blue advances towards the lower squares.
+    """
+    enemy = position[0] if maximizing_player else position[1]
+    valid_moves.sort(key=lambda move: (enemy >> move[1] & 1, move[1] if maximizing_player else -move[1]), reverse=True)
+
+
+def red_wins(position, maximizing_player, moves):
+    """
+    Whether red wins with perfect play from a position that isn't over.
+    """
+    global nodes
+    nodes += 1
+    if not nodes & 0xFFFF and stop is not None and stop.value:
+        raise SearchTimeout
+    blue, red = position
+    if moves > LAST_MOVE:
+        return True
+    # a tile one step from the other side wins on its next move
+    if maximizing_player:
+        if red & RED_LAST_STEP:
+            return True
+        threats = blue & BLUE_LAST_STEP
+    else:
+        if blue & BLUE_LAST_STEP:
+            return False
+        threats = red & RED_LAST_STEP
+    if threats & (threats - 1):
+        # only one of them can be taken
+        return not maximizing_player
+    if not maximizing_player and blue_lost(position, moves):
+        return True
+
+    key = bitboard.position_key(position, moves)
+    value = table.get(key)
+    if value is not None:
+        return value
+    if ai.tablebase is not None:
+        value = ai.tablebase.probe_position(position, moves)
+        if value is not None:
+            return value > 0
+
+    valid_moves = bitboard.get_valid_moves(position, maximizing_player)
+    if threats:
+        valid_moves = [move for move in valid_moves if threats >> move[1] & 1]
+    else:
+        order_moves(position, maximizing_player, valid_moves)
+
+    # the side to move wins if one of its moves wins
+    result = not maximizing_player
+    for move in valid_moves:
+        child = bitboard.perform_move(position, maximizing_player, move)
+        winning = bitboard.is_winning(child)
+        child_red_wins = winning == 2 if winning else red_wins(child, not maximizing_player, moves + 1)
+        if child_red_wins == maximizing_player:
+            result = maximizing_player
+            break
+
+    if len(table) >= MAX_TABLE:
+        table.clear()
+    table[key] = result
+    return result
+
+
+def solve_unit(position, moves):
+    """
+    Solves one work unit. Returns whether red wins, the positions visited
+    and the seconds it took.
+    """
+    global nodes
+    nodes = 0
+    start = time.perf_counter()
+    result = red_wins(position, moves % 2 == 1, moves)
+    return result, nodes, time.perf_counter() - start
+
+
+def read_checkpoint(path):
+    """
+    `{position_key: whether red wins}` of the units solved in `path`. A line
+    cut short by a run that was stopped while writing it is cut off the
+    file, so the next run appends after the last whole line.
+    """
+    solved = {}
+    if not os.path.exists(path):
+        return solved
+    with open(path, "rb+") as f:
+        end = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                f.truncate(end)
+                break
+            key, red_won, _, _ = line.split()
+            solved[int(key)] = red_won == b"1"
+            end += len(line)
+    return solved
+
+
+def top_tree(split):
+    """
+    The positions of the first `split` plies that aren't over, one of each
+    mirror pair: `{position_key: (moves, children)}`, `children` being
+    `(move, child key, None)` in the order they are searched, or `(move,
+    None, whether red won)` for a move that ends the game. Also returns the
+    positions `split` plies in, the work units, as `{position_key:
+    (position, moves)}`.
+    """
+    nodes = {}
+    start = bitboard.from_tiles(Board.new().tiles)
+    layer = {bitboard.position_key(start, 0): start}
+    for moves in range(split):
+        maximizing_player = moves % 2 == 1
+        next_layer = {}
+        for key, position in layer.items():
+            valid_moves = bitboard.get_valid_moves(position, maximizing_player)
+            if book.mirror_position(position) == position:
+                valid_moves = bitboard.drop_mirrored_moves(valid_moves)
+            order_moves(position, maximizing_player, valid_moves)
+            children = []
+            for move in valid_moves:
+                child = bitboard.perform_move(position, maximizing_player, move)
+                winning = bitboard.is_winning(child)
+                if winning:
+                    children.append((move, None, winning == 2))
+                    continue
+                child_key, mirrored = book.canonical(child, moves + 1)
+                next_layer[child_key] = book.mirror_position(child) if mirrored else child
+                children.append((move, child_key, None))
+            nodes[key] = moves, children
+        layer = next_layer
+    return nodes, {key: (position, split) for key, position in layer.items()}
+
+
+def tree_value(nodes, solved, key, values):
+    """
+    Whether red wins at the position `key` of the tree as far as the solved
+    units tell, `None` while it isn't known. `values` caches the answers for
+    one state of `solved`.
+    """
+    if key in solved:
+        return solved[key]
+    if key not in nodes:
+        return None
+    if key not in values:
+        moves, children = nodes[key]
+        maximizing_player = moves % 2 == 1
+        # the side to move wins as soon as one move wins, and loses once every move is known to lose
+        value = not maximizing_player
+        for _, child, red_won in children:
+            if child is not None:
+                red_won = tree_value(nodes, solved, child, values)
+            if red_won == maximizing_player:
+                value = maximizing_player
+                break
+            if red_won is None:
+                value = None
+        values[key] = value
+    return values[key]
+
+
+def needed_units(nodes, solved, root, full=False):
+    """
+    The unsolved units that can still change the value of the root, in the
+    order a search from the root would reach them: the ones with no decided
+    position on the way from the root. With `full`, every unsolved unit.
+    """
+    values = {}
+    needed = []
+    seen = set()
+
+    def visit(key):
+        if key in seen or key in solved:
+            return
+        seen.add(key)
+        if key not in nodes:
+            needed.append(key)
+            return
+        if not full and tree_value(nodes, solved, key, values) is not None:
+            return
+        for _, child, _ in nodes[key][1]:
+            if child is not None:
+                visit(child)
+
+    visit(root)
+    return needed
+
+
+def solve(split, workers=1, checkpoint="solve_checkpoint.txt", tablebase="tablebase.bin", full=False, progress=None):
+    """
+    Solves the units of `top_tree(split)` in a pool of `workers` processes
+    until the start position is decided, or until all are solved with
+    `full`, then stops the units still running. Units found in `checkpoint`
+    aren't solved again, and every unit solved is appended to it. Returns the tree and `{unit key: whether red
+    wins}`.
+    """
+    nodes, units = top_tree(split)
+    root = bitboard.position_key(bitboard.from_tiles(Board.new().tiles), 0)
+    solved = {key: value for key, value in read_checkpoint(checkpoint).items() if key in units}
+    # few units are queued at a time, so the ones that stop being needed are never started
+    queued = 2 * workers
+    running = {}
+    start = time.perf_counter()
+    total_nodes = 0
+    stop_flag = multiprocessing.Value("b", 0, lock=False)
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(tablebase, stop_flag)) as executor, open(checkpoint, "a") as f:
+        try:
+            while True:
+                needed = needed_units(nodes, solved, root, full)
+                # the units still running can't change the result
+                if not needed:
+                    break
+                started = set(running.values())
+                for key in needed:
+                    if len(running) >= queued:
+                        break
+                    if key not in started:
+                        running[executor.submit(solve_unit, *units[key])] = key
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    result, unit_nodes, seconds = future.result()
+                    solved[key] = result
+                    f.write(f"{key} {int(result)} {unit_nodes} {seconds:.3f}\n")
+                    f.flush()
+                    total_nodes += unit_nodes
+                if progress is not None:
+                    progress(len(solved), len(units), len(needed), total_nodes, time.perf_counter() - start)
+        finally:
+            # don't wait for the units that haven't started or are still running
+            stop_flag.value = 1
+            executor.shutdown(cancel_futures=True)
+    return nodes, solved
+
+
+def proven_moves(nodes, solved):
+    """
+    Sorted book records of the tree's positions where the side to move is
+    known to win: every move whose result is known, scored `WIN_SCORE` for
+    the side that wins after it. The losing side's positions are left out,
+    so it searches instead of playing any lost move.
+    """
+    values = {}
+    records = []
+    for key, (moves, children) in nodes.items():
+        maximizing_player = moves % 2 == 1
+        if tree_value(nodes, solved, key, values) != maximizing_player:
+            continue
+        for move, child, red_won in children:
+            if child is not None:
+                red_won = tree_value(nodes, solved, child, values)
+            if red_won is not None:
+                records.append((key, book.pack(move, WIN_SCORE if red_won else -WIN_SCORE)))
+    records.sort()
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solve the game with a pool of processes and write the proven moves as an opening book.")
+    parser.add_argument("--split", type=int, default=6, help="plies in of the work units, the book covers the plies above them")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--checkpoint", default="solve_checkpoint.txt", help="solved units, read on start and appended to")
+    parser.add_argument("--tablebase", default="tablebase.bin")
+    parser.add_argument("--full", action="store_true", help="solve every unit instead of stopping once the game is decided")
+    parser.add_argument("--out", default="opening_book.bin")
+    args = parser.parse_args()
+
+    def progress(solved, units, needed, total_nodes, seconds):
+        print(f"{solved}/{units} units solved, {needed} still needed, "
+              f"{total_nodes / max(seconds, 1e-9):,.0f} positions/s, {seconds:.0f}s", flush=True)
+
+    try:
+        nodes, solved = solve(args.split, args.workers, args.checkpoint, args.tablebase, args.full, progress)
+    except KeyboardInterrupt:
+        print(f"stopped, run again to carry on from {args.checkpoint}")
+        return
+    root = bitboard.position_key(bitboard.from_tiles(Board.new().tiles), 0)
+    print("red" if tree_value(nodes, solved, root, {}) else "blue", "wins")
+    records = proven_moves(nodes, solved)
+    position_file.write(args.out, book.KIND, [key for key, _ in records], [value for _, value in records], "i", (args.split, SOLVED_DEPTH))
+    print(f"wrote {len(records)} moves to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
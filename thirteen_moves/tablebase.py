@@ -0,0 +1,140 @@
+import argparse
+import os
+import time
+from array import array
+from bisect import bisect_left
+from itertools import combinations
+import ai
+import bitboard
+import position_file
+from ai import LAST_MOVE
+
+WIDTH = bitboard.WIDTH
+SQUARES = bitboard.WIDTH * bitboard.HEIGHT
+
+KIND = b"TBAS"
+
+
+def solve_child(layers, position, maximizing_player, moves, move):
+    child = bitboard.perform_move(position, maximizing_player, move)
+    winning = bitboard.is_winning(child)
+    if winning == 1:
+        return -(27-(moves+1))*10
+    if winning == 2 or moves + 1 > LAST_MOVE:
+        return (27-(moves+1))*10
+    return layers[moves+1][child]
+
+
+class Tablebase:
+    """
+    Exact values (in `minimax` units, so the sign is the winner and the
+    size is how soon) of every position with at most `max_pieces` tiles a
+    side, from move `first_move` until the end of the game.
+    """
+    def __init__(self, first_move, max_pieces, keys, values, file=None):
+        self.first_move = first_move
+        self.max_pieces = max_pieces
+        # sorted `bitboard.position_key`s and the value of each divided by 10, either
+        # arrays or views into the memory-mapped `file`
+        self.keys = keys
+        self.values = values
+        self.file = file
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def generate(cls, plies=6, max_pieces=2, progress=None):
+        """
+        Retrograde analysis of the last `plies` plies. Each move advances a
+        tile, so the game never repeats a position and every layer only
+        depends on the layer after it: positions `LAST_MOVE` are solved
+        first, then `LAST_MOVE - 1` from them and so on. Captures only
+        remove tiles, so a layer's children are always in the next layer.
+        """
+        first_move = LAST_MOVE + 1 - plies
+
+        blue_sets = []
+        red_sets = []
+        for n in range(1, max_pieces + 1):
+            # blue on the first row or red on the last has already won
+            blue_sets += [sum(1 << t for t in c) for c in combinations(range(WIDTH, SQUARES), n)]
+            red_sets += [sum(1 << t for t in c) for c in combinations(range(SQUARES - WIDTH), n)]
+        universe = [(blue, red) for blue in blue_sets for red in red_sets if not blue & red]
+
+        layers = {}
+        records = []
+        for moves in range(LAST_MOVE, first_move - 1, -1):
+            start = time.perf_counter()
+            maximizing_player = moves % 2 == 1
+            pick = max if maximizing_player else min
+            layer = {
+                position: pick(solve_child(layers, position, maximizing_player, moves, move)
+                               for move in bitboard.get_valid_moves(position, maximizing_player))
+                for position in universe
+            }
+            records += [(bitboard.position_key(position, moves), value // 10) for position, value in layer.items()]
+            # only the layer just solved is needed for the next one
+            layers = {moves: layer}
+            if progress is not None:
+                progress(moves, len(layer), time.perf_counter() - start)
+
+        records.sort()
+        return cls(first_move, max_pieces, array("Q", [k for k, _ in records]), array("b", [v for _, v in records]))
+
+    def save(self, path):
+        position_file.write(path, KIND, self.keys, self.values, "b", (self.first_move, self.max_pieces))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-maps the file instead of reading it, see `position_file.PositionFile`.
+        """
+        file = position_file.PositionFile(path, KIND)
+        first_move, max_pieces = file.params[:2]
+        return cls(first_move, max_pieces, file.keys, file.values, file)
+
+    def probe(self, tiles, moves):
+        """
+        Value of a list engine position, `None` if it isn't in the table.
+        """
+        if moves < self.first_move or len(tiles[0]) > self.max_pieces or len(tiles[1]) > self.max_pieces:
+            return None
+        return self.probe_position(bitboard.from_tiles(tiles), moves)
+
+    def probe_position(self, position, moves):
+        if moves < self.first_move or position[0].bit_count() > self.max_pieces or position[1].bit_count() > self.max_pieces:
+            return None
+        key = bitboard.position_key(position, moves)
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.values[i] * 10
+        return None
+
+
+def load_tablebase(path):
+    """
+    Makes the searches probe the tablebase at `path` if the file exists.
+    Also usable as a process pool initializer, so every worker maps it.
+    """
+    if ai.tablebase is None and os.path.exists(path):
+        ai.tablebase = Tablebase.load(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate an endgame tablebase for the last plies of the game.")
+    parser.add_argument("--plies", type=int, default=12, help="number of plies before the end of the game to solve")
+    parser.add_argument("--max-pieces", type=int, default=2, help="max tiles of each color")
+    parser.add_argument("--out", default="tablebase.bin")
+    args = parser.parse_args()
+
+    def progress(moves, positions, seconds):
+        print(f"move {moves}: {positions} positions in {seconds:.1f}s", flush=True)
+
+    tb = Tablebase.generate(args.plies, args.max_pieces, progress)
+    tb.save(args.out)
+    print(f"wrote {len(tb)} positions to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import argparse
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+import ai
+import mcts
+from ai import LAST_MOVE
+from board import Board, BLUE, RED
+from transposition import TranspositionTable
+from tablebase import load_tablebase
+from book import load_book
+from weights import load_weights, read_weights, set_weights
+from search_stats import JsonLinesWriter
+from game_log import GameRecord, Ply, player_name, write_game
+
+
+def parse_player(spec):
+    """
+    Reads a player like `bitboard,depth=8,time=200` into the keyword
+    arguments of `ai.play`: the engine, then optional `depth` and `time`
+    (milliseconds per move). `weights=file` makes the player evaluate with
+    the weights in the file (see `tune.py`).
+    """
+    engine, *options = spec.split(",")
+    if engine not in ("list", "bitboard", "mcts"):
+        raise argparse.ArgumentTypeError(f"unknown engine {engine!r}")
+    config = {"engine": engine, "depth": None, "time_ms": None, "weights": None}
+    for option in options:
+        name, _, value = option.partition("=")
+        if name == "depth":
+            config["depth"] = int(value)
+        elif name == "time":
+            config["time_ms"] = int(value)
+        elif name == "weights":
+            # checked now rather than when the player's first game starts
+            if not os.path.exists(value):
+                raise argparse.ArgumentTypeError(f"no weights file {value!r}")
+            config["weights"] = value
+        else:
+            raise argparse.ArgumentTypeError(f"unknown option {name!r} in {spec!r}")
+    if config["depth"] is None and config["time_ms"] is None:
+        raise argparse.ArgumentTypeError(f"{spec!r} needs a depth or a time")
+    return config
+
+
+def random_opening(plies, rng):
+    """
+    `plies` random moves from the start that don't end the game.
+    """
+    board = Board.new()
+    opening = []
+    for moves in range(plies):
+        color = RED if moves % 2 == 1 else BLUE
+        candidates = []
+        for move in board.get_valid_moves(color):
+            child = board.clone()
+            child.perform_move(color, move)
+            if not child.is_winning():
+                candidates.append(move)
+        move = rng.choice(candidates)
+        board.perform_move(color, move)
+        opening.append(move)
+    return opening
+
+
+# Weights of the worker's players by file, `None` for the weights `init_worker` set
+player_weights = {}
+# File of the weights evaluation uses now
+current_weights = None
+
+
+def use_weights(path):
+    """
+    Switches evaluation to the weights in `path`, which takes a few
+    milliseconds, so only when they differ from the current ones.
+    """
+    global current_weights
+    if path == current_weights:
+        return
+    if path not in player_weights:
+        player_weights[path] = read_weights(path)
+    set_weights(*player_weights[path])
+    current_weights = path
+
+
+def play_game(players, opening, seed, tt_mb=16):
+    """
+    Plays one game between two `parse_player` configs, `players[BLUE]`
+    and `players[RED]`, starting with the moves of `opening`. Returns the
+    winner, by color the number of moves searched, seconds spent and nodes
+    searched, and the `game_log.Ply` of every move.
+    """
+    board = Board.new()
+    plies = []
+    for moves, move in enumerate(opening):
+        board.perform_move(RED if moves % 2 == 1 else BLUE, move)
+        plies.append(Ply(*move))
+    # each player keeps its own table and mcts tree for the whole game, like in a real game
+    tts = {BLUE: TranspositionTable(tt_mb), RED: TranspositionTable(tt_mb)}
+    trees = {BLUE: None, RED: None}
+    stats = {BLUE: [0, 0.0, 0], RED: [0, 0.0, 0]}
+    rng = random.Random(seed)
+
+    moves = len(opening)
+    while True:
+        winner = board.is_winning()
+        if winner:
+            break
+        if moves > LAST_MOVE:
+            winner = RED
+            break
+
+        color = RED if moves % 2 == 1 else BLUE
+        options = dict(players[color])
+        use_weights(options.pop("weights"))
+        mcts.tree = trees[color]
+        start = time.perf_counter()
+        result = ai.play(board, color == RED, moves, tt=tts[color], seed=rng.getrandbits(32), **options)
+        elapsed = time.perf_counter() - start
+        trees[color] = mcts.tree
+
+        player_tiles = board.tiles[1] if color == RED else board.tiles[0]
+        move = [player_tiles[result.move[0]], result.move[1]]
+        board.perform_move(color, move)
+        plies.append(Ply(*move, result.score, result.depth, 1000 * elapsed, result.nodes))
+        moves += 1
+
+        stats[color][0] += 1
+        stats[color][1] += elapsed
+        stats[color][2] += result.nodes
+    return winner, stats, plies
+
+
+def wilson_interval(wins, games, z=1.96):
+    """
+    95% confidence interval of a win rate, by the Wilson score method, which
+    stays inside [0, 1] for few games or lopsided results.
+    """
+    if games == 0:
+        return 0.0, 1.0
+    p = wins / games
+    center = (p + z * z / (2 * games)) / (1 + z * z / games)
+    half = z * math.sqrt(p * (1 - p) / games + z * z / (4 * games * games)) / (1 + z * z / games)
+    return center - half, center + half
+
+
+def schedule(players, games, opening_plies, seed):
+    """
+    Yields `(index of blue, index of red, opening, seed)` for `games` games
+    between every pair of players. Every opening is played twice with the
+    colors swapped, since the game isn't symmetric between blue and red.
+    """
+    rng = random.Random(seed)
+    for a, b in combinations(range(len(players)), 2):
+        for i in range(0, games, 2):
+            opening = random_opening(opening_plies, rng)
+            game_seed = rng.getrandbits(32)
+            yield a, b, opening, game_seed
+            if i + 1 < games:
+                yield b, a, opening, game_seed
+
+
+def init_worker(tablebase, book, weights, stats):
+    if tablebase is not None:
+        load_tablebase(tablebase)
+    if book is not None:
+        load_book(book)
+    if weights is not None:
+        load_weights(weights)
+    player_weights[None] = list(ai.red_square_vals), list(ai.blue_square_vals)
+    if stats is not None:
+        ai.stats_hook = JsonLinesWriter(stats)
+
+
+def run_game(players, blue, red, opening, seed, tt_mb):
+    winner, stats, plies = play_game({BLUE: players[blue], RED: players[red]}, opening, seed, tt_mb)
+    return blue, red, winner, stats, plies
+
+
+def run(players, games, opening_plies=2, workers=1, seed=None, tt_mb=16, tablebase=None, book=None, weights=None, stats=None,
+        log=None, progress=None):
+    """
+    Plays `games` games for every pair of `players` and returns the totals
+    of each player as dicts of `games`, `wins`, `blue_wins`, `red_wins`,
+    `moves`, `seconds` and `nodes`. The search statistics of every move
+    are appended to the file `stats` and the games to the game log `log`
+    if they are given.
+    """
+    games_list = list(schedule(players, games, opening_plies, seed))
+    totals = [dict(games=0, wins=0, blue_wins=0, red_wins=0, moves=0, seconds=0.0, nodes=0) for _ in players]
+
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(tablebase, book, weights, stats)) as executor:
+        futures = [executor.submit(run_game, players, blue, red, opening, game_seed, tt_mb) for blue, red, opening, game_seed in games_list]
+        for done, future in enumerate(futures):
+            blue, red, winner, game_stats, plies = future.result()
+            if log is not None:
+                write_game(log, GameRecord(winner, player_name(**players[blue]), player_name(**players[red]), plies, opening_plies))
+            for i, color in ((blue, BLUE), (red, RED)):
+                total = totals[i]
+                total["games"] += 1
+                if winner == color:
+                    total["wins"] += 1
+                    total["blue_wins" if color == BLUE else "red_wins"] += 1
+                moves, seconds, nodes = game_stats[color]
+                total["moves"] += moves
+                total["seconds"] += seconds
+                total["nodes"] += nodes
+            if progress is not None:
+                progress(done + 1, len(futures))
+    return totals
+
+
+def report(specs, totals):
+    print(f"{'player':<30} {'games':>6} {'win rate':>9} {'95% CI':>15} {'as blue':>8} {'as red':>7} {'ms/move':>8} {'nodes/s':>9}")
+    for spec, total in zip(specs, totals):
+        games = total["games"]
+        low, high = wilson_interval(total["wins"], games)
+        rate = total["wins"] / games if games else 0
+        ms = 1000 * total["seconds"] / total["moves"] if total["moves"] else 0
+        nps = total["nodes"] / total["seconds"] if total["seconds"] else 0
+        print(f"{spec:<30} {games:>6} {rate:>9.1%} {f'{low:.1%} - {high:.1%}':>15} {total['blue_wins']:>8} {total['red_wins']:>7} "
+              f"{ms:>8.1f} {nps:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play engine against engine games without the game window and compare the players.")
+    parser.add_argument("players", nargs="+", metavar="player",
+                        help="engine and settings, e.g. `bitboard,depth=8` or `list,time=200,depth=10,weights=weights.json`, every pair of players meets")
+    parser.add_argument("--games", type=int, default=100, help="games between every pair of players, half with each color")
+    parser.add_argument("--opening-plies", type=int, default=2, help="random moves each game starts with")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--tt-mb", type=int, default=16, help="transposition table size of every player")
+    parser.add_argument("--tablebase", default=None, help="tablebase file both players probe")
+    parser.add_argument("--book", default=None, help="opening book both players use")
+    parser.add_argument("--weights", default=None, help="evaluation weights both players use, see tune.py")
+    parser.add_argument("--stats", default=None, help="append the search statistics of every move to this file as JSON lines")
+    parser.add_argument("--log", default=None, help="append the games to this game log, see game_log.py")
+    args = parser.parse_args()
+    if len(args.players) < 2:
+        parser.error("at least two players are needed")
+    try:
+        players = [parse_player(spec) for spec in args.players]
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    start = time.perf_counter()
+
+    def progress(done, total):
+        if done % 10 == 0 or done == total:
+            print(f"{done}/{total} games, {time.perf_counter() - start:.0f}s", flush=True)
+
+    totals = run(players, args.games, args.opening_plies, args.workers, args.seed, args.tt_mb, args.tablebase, args.book, args.weights,
+                 args.stats, args.log, progress)
+    report(args.players, totals)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+from array import array
+
+# Bits of an entry's `data` word
+MOVE_BITS = 11
+FLAG_SHIFT = 12
+DEPTH_SHIFT = 16
+GENERATION_SHIFT = 24
+
+
+class TranspositionTable:
+    """
+    Fixed-size table of search results stored in flat arrays, so memory use
+    is decided once when it is created and never grows.
+
+    Keys are 64-bit position hashes. Each bucket has two entries: the first
+    keeps the deepest result of the current search (results of older
+    searches can always be replaced), the second is always replaced.
+    Moves are stored as `(from_tile, to_tile)`.
+    """
+    ENTRY_BYTES = 24
+
+    def __init__(self, size_mb=32):
+        buckets = 1
+        while buckets * 4 * self.ENTRY_BYTES <= size_mb * 1024 * 1024:
+            buckets *= 2
+        self.shift = 64 - (buckets.bit_length() - 1)
+        self.size = buckets * 2
+        self.clear()
+
+    def clear(self):
+        self.keys = array("Q", bytes(8 * self.size))
+        self.values = array("d", bytes(8 * self.size))
+        # generation << 24 | (depth + 1) << 16 | (flag + 1) << 12 | move, 0 when empty
+        self.data = array("q", bytes(8 * self.size))
+        self.generation = 0
+        # lookups since the table was cleared, which is the number of nodes searched with
+        # it, how many of them found an entry and the number of results stored
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def new_search(self):
+        """
+        Marks every stored result as old, so deep results from earlier
+        moves don't keep newer results out of the table.
+        """
+        self.generation += 1
+
+    def probe(self, key):
+        """
+        Returns `(flag, move, value, depth)` or `None`, `move` is `None`
+        if no move was stored.
+        """
+        self.probes += 1
+        # Fibonacci hashing, so keys that only differ in the high bits still spread out. Written
+        # out here and in `store`, which are called for every node.
+        i = (((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> self.shift) << 1
+        keys = self.keys
+        if keys[i] != key or not self.data[i]:
+            i += 1
+            if keys[i] != key or not self.data[i]:
+                return None
+
+        self.hits += 1
+        data = self.data[i]
+        move = None
+        if data & (1 << (MOVE_BITS - 1)):
+            move = (data >> 5) & 31, data & 31
+        return ((data >> FLAG_SHIFT) & 3) - 1, move, self.values[i], ((data >> DEPTH_SHIFT) & 255) - 1
+
+    def store(self, key, flag, move, value, depth):
+        self.stores += 1
+        i = (((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> self.shift) << 1
+        old = self.data[i]
+        if old and self.keys[i] != key and old >> GENERATION_SHIFT == self.generation and depth < ((old >> DEPTH_SHIFT) & 255) - 1:
+            i += 1
+
+        data = self.generation << GENERATION_SHIFT | (depth + 1) << DEPTH_SHIFT | (flag + 1) << FLAG_SHIFT
+        if move is not None:
+            data |= 1 << (MOVE_BITS - 1) | move[0] << 5 | move[1]
+        self.keys[i] = key
+        self.values[i] = value
+        self.data[i] = data
@@ -0,0 +1,262 @@
+"""
+Fits the per-square evaluation weights to positions of self-play games
+or game logs (see `game_log`), Texel style: the winning chance a position's evaluation predicts,
+`sigmoid(scale * evaluate)`, should match the result of the game it came
+from, or the score a deeper search gave it. Needs NumPy.
+
+    python3 tune.py --generate 2000 --positions positions.txt --out weights.json
+
+The game and the tools load the weights with `weights.load_weights`.
+"""
+import argparse
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import ai
+import batch
+import bitboard
+from ai import LAST_MOVE
+from board import Board, BLUE, RED
+from transposition import TranspositionTable
+from tablebase import load_tablebase
+from tournament import random_opening
+from weights import load_weights, save_weights
+from game_log import read_games, replay
+
+SQUARES = Board.WIDTH * Board.HEIGHT
+# The squares of the left half and the middle column. Weights are tied
+# between mirrored squares, so these are all the weights a color has.
+HALF = [t for t in range(SQUARES) if t % Board.WIDTH <= (Board.WIDTH - 1) // 2]
+# FOLD[t, i] is 1 if square t has the weight of HALF[i]
+FOLD = np.zeros((SQUARES, len(HALF)), dtype=np.float32)
+for t in range(SQUARES):
+    FOLD[t, HALF.index(min(t, Board.mirror_tile(t)))] = 1
+
+
+def self_play(depth, opening_plies, seed):
+    """
+    Plays one game of the bitboard engine against itself. Returns a
+    `(blue, red, moves, winner, score)` line for every position searched,
+    `winner` being 1 for blue and 2 for red and `score` the search's
+    score for red.
+    """
+    rng = random.Random(seed)
+    board = Board.new()
+    moves = 0
+    for move in random_opening(opening_plies, rng):
+        board.perform_move(RED if moves % 2 == 1 else BLUE, move)
+        moves += 1
+    tt = TranspositionTable(4)
+    lines = []
+    while not board.is_winning() and moves <= LAST_MOVE:
+        color = RED if moves % 2 == 1 else BLUE
+        result = ai.play(board, color == RED, moves, depth, engine="bitboard", tt=tt, seed=rng.getrandbits(32))
+        blue, red = bitboard.from_tiles(board.tiles)
+        lines.append([blue, red, moves, None, result.score])
+        player_tiles = board.tiles[1] if color == RED else board.tiles[0]
+        board.perform_move(color, [player_tiles[result.move[0]], result.move[1]])
+        moves += 1
+    # 1 if blue won and 2 if red did, like `bitboard.is_winning`
+    winner = 2 if (board.is_winning() or RED) == RED else 1
+    for line in lines:
+        line[3] = winner
+    return lines
+
+
+def generate(path, games, depth, opening_plies=4, workers=1, seed=None, tablebase=None, progress=None):
+    """
+    Appends the positions of `games` self-play games to `path`, a line of
+    `blue red moves winner score` each.
+    """
+    rng = random.Random(seed)
+    seeds = [rng.getrandbits(32) for _ in range(games)]
+    with ProcessPoolExecutor(workers, initializer=load_tablebase, initargs=(tablebase,)) as executor, open(path, "a") as f:
+        futures = [executor.submit(self_play, depth, opening_plies, game_seed) for game_seed in seeds]
+        for done, future in enumerate(futures):
+            for blue, red, moves, winner, score in future.result():
+                f.write(f"{blue} {red} {moves} {winner} {score!r}\n")
+            if progress is not None:
+                progress(done + 1, games)
+
+
+def add_log(path, log):
+    """
+    Appends the positions of the game log `log` that were searched to
+    `path`, in the format of `generate`. Moves of mcts players are left
+    out, their scores are win rates and not evaluations.
+    """
+    with open(path, "a") as f:
+        for game in read_games(log):
+            winner = 2 if game.winner == RED else 1
+            # the engine is the first part of a player's name, see `game_log.player_name`
+            mcts = {BLUE: game.blue.split(",")[0] == "mcts", RED: game.red.split(",")[0] == "mcts"}
+            for board, moves, ply in replay(game):
+                if ply.depth and not mcts[RED if moves % 2 == 1 else BLUE]:
+                    blue, red = bitboard.from_tiles(board.tiles)
+                    f.write(f"{blue} {red} {moves} {winner} {ply.score!r}\n")
+
+
+def read_positions(path, chunk_lines=1 << 16):
+    """
+    Reads the positions of `path` a chunk at a time into arrays of boards
+    (packed, see `batch`), move counts, winners and scores.
+    """
+    boards, moves, winners, scores = [], [], [], []
+    with open(path) as f:
+        while True:
+            lines = [line.split() for _, line in zip(range(chunk_lines), f)]
+            if not lines:
+                break
+            boards.append(np.array([(int(line[0]), int(line[1])) for line in lines], dtype=np.int64))
+            moves.append(np.array([int(line[2]) for line in lines], dtype=np.int8))
+            winners.append(np.array([int(line[3]) for line in lines], dtype=np.int8))
+            scores.append(np.array([float(line[4]) for line in lines]))
+    if not boards:
+        raise ValueError(f"no positions in {path}")
+    return np.concatenate(boards), np.concatenate(moves), np.concatenate(winners), np.concatenate(scores)
+
+
+def quiet(boards, moves):
+    """
+    Positions worth fitting: the game isn't over and the side to move
+    can't win with its next move, where the evaluation doesn't matter.
+    """
+    blue, red = boards[:, 0], boards[:, 1]
+    red_to_move = moves % 2 == 1
+    winning_move = np.where(red_to_move, red & bitboard.RED_LAST_STEP, blue & bitboard.BLUE_LAST_STEP) != 0
+    return (batch.is_winning(boards) == 0) & ~winning_move & (moves <= LAST_MOVE)
+
+
+def features(boards, moves, chunk=1 << 16):
+    """
+    Matrix that multiplied with `fold(red, blue)` gives the evaluation of
+    every position plus an offset for its move count. The offsets take up
+    how far ahead red is for the move count alone (red wins when time runs
+    out), which the weights would otherwise be bent to fit. They are left
+    out of the evaluation, where they would change no search's choice.
+    """
+    result = np.zeros((len(boards), 2 * len(HALF) + LAST_MOVE + 1), dtype=np.float32)
+    for i in range(0, len(boards), chunk):
+        occupancy = batch.unpack(boards[i:i + chunk]).astype(np.float32)
+        result[i:i + chunk, :len(HALF)] = occupancy[:, 1] @ FOLD
+        result[i:i + chunk, len(HALF):2 * len(HALF)] = -(occupancy[:, 0] @ FOLD)
+    result[np.arange(len(boards)), 2 * len(HALF) + moves] = 1
+    return result
+
+
+def fold(red, blue):
+    return np.array([red[t] for t in HALF] + [blue[t] for t in HALF] + [0] * (LAST_MOVE + 1), dtype=np.float64)
+
+
+def unfold(w):
+    red = w[:len(HALF)] @ FOLD.T
+    blue = w[len(HALF):2 * len(HALF)] @ FOLD.T
+    return [float(v) for v in red], [float(v) for v in blue]
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def loss(X, y, w, scale):
+    return float(np.mean((sigmoid(scale * (X @ w)) - y) ** 2))
+
+
+def fit_scale(X, y, w):
+    """
+    The scale that makes the weights `w` predict `y` best, searched on a
+    logarithmic grid and then refined around the best point.
+    """
+    grid = np.logspace(-3, 1, 41)
+    best = min(grid, key=lambda scale: loss(X, y, w, scale))
+    fine = np.linspace(best / 1.3, best * 1.3, 41)
+    return float(min(fine, key=lambda scale: loss(X, y, w, scale)))
+
+
+def fit(X, y, w, scale, steps=500, learning_rate=0.01, l2=0.0, progress=None):
+    """
+    Full batch gradient descent of the squared error with Adam steps. `l2`
+    pulls the weights towards where they started, a small set of games
+    otherwise gives weights that fit it but play worse.
+    """
+    start = w
+    # the move count offsets aren't pulled back, they start at 0 anyway
+    pulled = np.zeros_like(w)
+    pulled[:2 * len(HALF)] = 1
+    w = w.copy()
+    m = np.zeros_like(w)
+    v = np.zeros_like(w)
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    for step in range(1, steps + 1):
+        p = sigmoid(scale * (X @ w))
+        # d/dw of mean((p - y)^2) + l2 * |w - start|^2
+        grad = X.T @ ((p - y) * p * (1 - p)) * (2 * scale / len(y)) + 2 * l2 * pulled * (w - start)
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad * grad
+        w -= learning_rate * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + eps)
+        if progress is not None and (step % 50 == 0 or step == steps):
+            progress(step, loss(X, y, w, scale))
+    return w
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the evaluation weights on the positions of self-play games.")
+    parser.add_argument("--positions", default="positions.txt", help="file of positions, appended to by --generate")
+    parser.add_argument("--generate", type=int, default=0, metavar="GAMES", help="self-play games to add to the positions first")
+    parser.add_argument("--log", action="append", default=[], help="game log (see game_log.py) whose positions to add first")
+    parser.add_argument("--depth", type=int, default=6, help="search depth of the self-play games")
+    parser.add_argument("--opening-plies", type=int, default=4, help="random moves each game starts with")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--tablebase", default="tablebase.bin")
+    parser.add_argument("--label", choices=("result", "search"), default="result",
+                        help="fit to the game results or to the scores of the self-play searches")
+    parser.add_argument("--start", default=None, help="weights to start from, the current defaults otherwise")
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--learning-rate", type=float, default=0.01)
+    parser.add_argument("--l2", type=float, default=0.01, help="strength of the pull towards the starting weights")
+    parser.add_argument("--validation", type=float, default=0.1, help="share of the positions, from the end of the file, held out to check the fit")
+    parser.add_argument("--out", default="weights.json")
+    args = parser.parse_args()
+
+    if args.generate:
+        def generate_progress(done, total):
+            if done % 50 == 0 or done == total:
+                print(f"{done}/{total} games", flush=True)
+        generate(args.positions, args.generate, args.depth, args.opening_plies, args.workers, args.seed, args.tablebase, generate_progress)
+
+    for log in args.log:
+        add_log(args.positions, log)
+
+    if args.start is not None:
+        load_weights(args.start)
+    boards, moves, winners, scores = read_positions(args.positions)
+    keep = quiet(boards, moves)
+    boards, moves, winners, scores = boards[keep], moves[keep], winners[keep], scores[keep]
+    X = features(boards, moves)
+    w = fold(ai.red_square_vals, ai.blue_square_vals)
+    results = (winners == 2).astype(np.float32)
+    scale = fit_scale(X, results, w)
+    y = results if args.label == "result" else sigmoid(scale * scores).astype(np.float32)
+    print(f"{len(boards)} quiet positions, scale {scale:.4f}")
+
+    # the positions of one game are alike, so the last games of the file are held
+    # out rather than positions picked at random, which would overstate the fit
+    split = int(len(boards) * (1 - args.validation))
+    train, test = slice(0, split), slice(split, None)
+    print(f"loss before: train {loss(X[train], y[train], w, scale):.5f}, validation {loss(X[test], y[test], w, scale):.5f}")
+    w = fit(X[train], y[train], w, scale, args.steps, args.learning_rate, args.l2,
+            lambda step, train_loss: print(f"step {step}: train {train_loss:.5f}", flush=True))
+    print(f"loss after: train {loss(X[train], y[train], w, scale):.5f}, validation {loss(X[test], y[test], w, scale):.5f}")
+
+    red, blue = unfold(w)
+    save_weights(args.out, red, blue)
+    for name, values in (("red", red), ("blue", blue)):
+        print(name)
+        for row in range(Board.HEIGHT):
+            print("  " + " ".join(f"{v:6.3f}" for v in values[row * Board.WIDTH:(row + 1) * Board.WIDTH]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,49 @@
+from functools import lru_cache
 import pygame
 
 
+@lru_cache(maxsize=None)
+def get_font(font, font_size):
+    # looking a system font up and loading it is slow, so each is only loaded once
+    return pygame.freetype.SysFont(font, font_size)
+
+
+@lru_cache(maxsize=256)
+def text_surface(text, color, font_size, font):
+    return get_font(font, font_size).render(text, color)
+
+
+@lru_cache(maxsize=64)
+def alpha_surface(w, h, color, alpha):
+    rect = pygame.Surface((w, h))
+    rect.set_alpha(alpha * 255)
+    rect.fill(color)
+    return rect
+
+
 def alpha_rect(surface, rect=None, color=(0, 0, 0), alpha=1):
     if rect is None:
         x, y, w, h = 0, 0, surface.get_width(), surface.get_height()
     else:
         x, y, w, h = rect
 
-    rect = pygame.Surface((w, h))
-    rect.set_alpha(alpha * 255)
-    rect.fill(color)
-    surface.blit(rect, (x, y))
+    surface.blit(alpha_surface(w, h, color, alpha), (x, y))
 
 
-def get_text_rect(text, font_size=60, font="ariablack"):
-    font = pygame.freetype.SysFont(font, font_size)
-    return font.get_rect(text)
+def get_text_rect(text, font_size=60, font="arialblack"):
+    return get_font(font, font_size).get_rect(text)
 
 
 def centered_text(surface, text, x=0, y=0, color=(0, 0, 0), font_size=60, font="arialblack"):
-    font = pygame.freetype.SysFont(font, font_size)
-    text_rect = font.get_rect(text)
+    """
+    Draws `text` centered on `(x, y)` and returns the rect it covers. The
+    rendered text is cached, so drawing the same text again is one blit.
+    """
+    text_surf, text_rect = text_surface(text, color, font_size, font)
+    text_rect = text_rect.copy()
     text_rect.center = x, y
-    font.render_to(surface, text_rect.topleft, text, color)
+    surface.blit(text_surf, text_rect)
+    return text_rect
 
 
 def set_cursor_to_hand():
@@ -41,7 +62,7 @@ class Text:
         self.color = color
         self.highlighted_color = highlighted_color
         self.font_size = font_size
-        self.font = "ariablack"
+        self.font = font
 
         self.rect = get_text_rect(text, font_size, font)
         self.highlighted = False
@@ -0,0 +1,50 @@
+import json
+import os
+import ai
+import bitboard
+from board import Board
+
+SQUARES = Board.WIDTH * Board.HEIGHT
+
+
+def set_weights(red, blue):
+    """
+    Makes `evaluate` of both engines value a red tile on square `t` at
+    `red[t]` and a blue one at `blue[t]`. The transposition tables are
+    cleared, since their scores came from the old weights.
+    """
+    for name, values in (("red", red), ("blue", blue)):
+        if len(values) != SQUARES:
+            raise ValueError(f"{name} needs {SQUARES} weights, not {len(values)}")
+        # a position and its mirror image share table entries, so they must score the same
+        if any(values[t] != values[Board.mirror_tile(t)] for t in range(SQUARES)):
+            raise ValueError(f"{name} weights aren't symmetric left to right")
+    ai.red_square_vals[:] = [float(value) for value in red]
+    ai.blue_square_vals[:] = [float(value) for value in blue]
+    bitboard.update_eval_tables()
+    for tt in (ai.transposition_table, bitboard.transposition_table):
+        if tt is not None:
+            tt.clear()
+
+
+def save_weights(path, red, blue):
+    with open(path, "w") as f:
+        json.dump({"red": list(red), "blue": list(blue)}, f, indent=1)
+
+
+def read_weights(path):
+    """
+    `(red, blue)` weights saved at `path`.
+    """
+    with open(path) as f:
+        weights = json.load(f)
+    return weights["red"], weights["blue"]
+
+
+def load_weights(path):
+    """
+    Sets the weights saved at `path` by `tune.py` if the file exists. Also
+    usable as a process pool initializer.
+    """
+    if os.path.exists(path):
+        set_weights(*read_weights(path))